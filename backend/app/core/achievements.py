@@ -1,7 +1,10 @@
 from enum import Enum
+import asyncio
 from datetime import datetime
-from typing import List, Dict, Optional, Any
+from types import MappingProxyType
+from typing import List, Dict, Optional, Any, Callable, Tuple
 from pydantic import BaseModel
+import json
 from .cache import CacheManager
 from .logging import logger
 from .notifications import notification_manager, NotificationType, NotificationPriority
@@ -41,12 +44,69 @@ class Achievement(BaseModel):
     unlocked_at: Optional[datetime] = None
     current_progress: Optional[int] = None
 
+    class Config:
+        # Экземпляры каталога разделяются между запросами
+        allow_mutation = False
+
 class AchievementProgress(BaseModel):
     achievement_type: AchievementType
     current_value: int
     target_value: int
     last_updated: datetime = datetime.now()
 
+def _event_player(event: GameEvent) -> List[str]:
+    return [event.player_id] if event.player_id else []
+
+def _event_winner(event: GameEvent) -> List[str]:
+    winner_id = event.data.get("winner_id")
+    return [str(winner_id)] if winner_id else []
+
+def _event_players(event: GameEvent) -> List[str]:
+    players = event.data.get("players")
+    return [str(player) for player in players] if players else _event_winner(event)
+
+def _event_losers(event: GameEvent) -> List[str]:
+    winners = set(_event_winner(event))
+    return [player for player in _event_players(event) if player not in winners]
+
+class AchievementRule(BaseModel):
+    """Декларативное правило достижения.
+
+    Правило срабатывает на событие `event_type` для каждого пользователя из
+    `subjects(event)`, если выполнен `predicate`. Правила со счетчиком
+    увеличивают поле `counter` в `user:{id}:stats` на `increment` и
+    разблокируют достижение при достижении `threshold`; правила без
+    счетчика разблокируют достижение сразу. Для пользователей из
+    `resets(event)` счетчик обнуляется (например, серия побед при поражении).
+    """
+    achievement_type: AchievementType
+    event_type: GameEventType
+    counter: Optional[str] = None
+    increment: int = 1
+    threshold: Optional[int] = None
+    predicate: Optional[Callable[[GameEvent], bool]] = None
+    subjects: Callable[[GameEvent], List[str]] = _event_player
+    resets: Optional[Callable[[GameEvent], List[str]]] = None
+
+    class Config:
+        allow_mutation = False
+
+    def is_reached(self, value: int) -> bool:
+        """Проверить, пересек ли счетчик порог этим событием"""
+        if value < self.threshold:
+            return False
+        # Для значений без приращения (рейтинг) проверяем только порог
+        return self.increment == 0 or value - self.increment < self.threshold
+
+def compile_rules(
+    rules: Tuple[AchievementRule, ...]
+) -> Dict[GameEventType, Tuple[AchievementRule, ...]]:
+    """Построить индекс правил по типу события"""
+    index: Dict[GameEventType, List[AchievementRule]] = {}
+    for rule in rules:
+        index.setdefault(rule.event_type, []).append(rule)
+    return {event_type: tuple(event_rules) for event_type, event_rules in index.items()}
+
 class AchievementManager:
     # Определение достижений
     ACHIEVEMENTS = {
@@ -157,34 +217,96 @@ class AchievementManager:
     }
 
     def __init__(self):
-        # Подписываемся на игровые события
-        event_manager.subscribe(GameEventType.GAME_FINISHED, self._handle_game_finished)
-        event_manager.subscribe(GameEventType.CHAT_MESSAGE, self._handle_chat_message)
-        event_manager.subscribe(GameEventType.NUMBER_MARKED, self._handle_number_marked)
+        self._unlock_script = None
+        # Ссылки на фоновые задачи уведомлений, чтобы их не собрал GC
+        self._pending_notifications = set()
+
+        # Индекс: тип события -> правила, на которые оно влияет
+        self.rule_index = compile_rules(ACHIEVEMENT_RULES)
+
+        # Подписываемся только на события, для которых есть правила
+        for event_type in self.rule_index:
+            event_manager.subscribe(event_type, self._handle_event)
 
     async def get_user_achievements(self, user_id: str) -> List[Achievement]:
         """Получить все достижения пользователя"""
         try:
             redis = await CacheManager.get_redis()
-            achievements_data = await redis.hgetall(f"user:{user_id}:achievements")
-            
-            achievements = []
-            for ach_type in AchievementType:
-                achievement = self.ACHIEVEMENTS[ach_type].copy()
-                achievement["type"] = ach_type
-                
-                if ach_type.value in achievements_data:
-                    data = achievements_data[ach_type.value]
-                    achievement["unlocked_at"] = datetime.fromisoformat(data)
-                
-                achievements.append(Achievement(**achievement))
-            
-            return achievements
+            cache_key = f"user:{user_id}:achievements:view"
+
+            # Версия читается до загрузки состояния: если разблокировка
+            # успеет между чтением и записью кэша, запись окажется устаревшей
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.get(cache_key)
+                pipe.get(f"user:{user_id}:achievements:version")
+                cached, version = await pipe.execute()
+            version = int(version or 0)
+
+            cached = json.loads(cached) if cached else None
+            if cached and cached.get("version") == version:
+                state = cached["state"]
+            else:
+                state = await self._load_user_state(redis, user_id)
+                await redis.setex(
+                    cache_key,
+                    ACHIEVEMENTS_VIEW_TTL,
+                    json.dumps({"version": version, "state": state})
+                )
+
+            return self._render(state)
             
         except Exception as e:
             logger.error(f"Error getting user achievements: {str(e)}")
             return []
 
+    async def get_achievement_points(self, user_id: str) -> int:
+        """Получить сумму очков достижений пользователя"""
+        try:
+            redis = await CacheManager.get_redis()
+            points = await redis.hget(f"user:{user_id}:stats", "achievement_points")
+            return int(points or 0)
+
+        except Exception as e:
+            logger.error(f"Error getting achievement points: {str(e)}")
+            return 0
+
+    async def _load_user_state(self, redis, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """Загрузить разблокировки и прогресс пользователя за один запрос"""
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(f"user:{user_id}:achievements")
+            pipe.mget([
+                f"user:{user_id}:achievement_progress:{ach_type.value}"
+                for ach_type in PROGRESS_ACHIEVEMENTS
+            ])
+            unlocked, progress = await pipe.execute()
+
+        state: Dict[str, Dict[str, Any]] = {}
+        for ach_type, unlocked_at in unlocked.items():
+            state.setdefault(ach_type, {})["unlocked_at"] = unlocked_at
+        for ach_type, raw in zip(PROGRESS_ACHIEVEMENTS, progress):
+            if raw:
+                current = json.loads(raw)["current_value"]
+                state.setdefault(ach_type.value, {})["current_progress"] = current
+        return state
+
+    def _render(self, state: Dict[str, Dict[str, Any]]) -> List[Achievement]:
+        """Наложить состояние пользователя на каталог"""
+        achievements = []
+        for ach_type, achievement in ACHIEVEMENT_CATALOG.items():
+            user_data = state.get(ach_type.value)
+            if user_data:
+                update = {"current_progress": user_data.get("current_progress")}
+                if user_data.get("unlocked_at"):
+                    update["unlocked_at"] = datetime.fromisoformat(user_data["unlocked_at"])
+                achievement = achievement.copy(update=update)
+            achievements.append(achievement)
+        return achievements
+
+    async def _invalidate_view(self, user_id: str):
+        """Сбросить кэш представления достижений пользователя"""
+        redis = await CacheManager.get_redis()
+        await redis.incr(f"user:{user_id}:achievements:version")
+
     async def get_achievement_progress(
         self,
         user_id: str,
@@ -197,7 +319,7 @@ class AchievementManager:
             progress_data = await redis.get(progress_key)
             
             if progress_data:
-                return AchievementProgress(**progress_data)
+                return AchievementProgress.parse_raw(progress_data)
             return None
             
         except Exception as e:
@@ -208,29 +330,43 @@ class AchievementManager:
         self,
         user_id: str,
         achievement_type: AchievementType
-    ):
-        """Разблокировать достижение"""
+    ) -> bool:
+        """Разблокировать достижение.
+
+        Проверка, запись и начисление очков выполняются одним скриптом,
+        поэтому параллельные события не начислят очки дважды. Возвращает
+        True, если достижение разблокировано этим вызовом.
+        """
         try:
             redis = await CacheManager.get_redis()
-            achievement_key = f"user:{user_id}:achievements"
-            
-            # Проверяем, не получено ли уже достижение
-            if await redis.hexists(achievement_key, achievement_type.value):
-                return
-            
-            # Разблокируем достижение
-            now = datetime.now()
-            await redis.hset(
-                achievement_key,
-                achievement_type.value,
-                now.isoformat()
-            )
-            
-            # Добавляем очки
+            if self._unlock_script is None:
+                self._unlock_script = redis.register_script(UNLOCK_ACHIEVEMENT_SCRIPT)
+
             points = self.ACHIEVEMENTS[achievement_type]["points"]
-            await redis.hincrby(f"user:{user_id}:stats", "achievement_points", points)
+            unlocked = await self._unlock_script(
+                keys=[
+                    f"user:{user_id}:achievements",
+                    f"user:{user_id}:stats",
+                    f"user:{user_id}:achievements:version"
+                ],
+                args=[achievement_type.value, datetime.now().isoformat(), points]
+            )
+            if not unlocked:
+                return False
+
+            # Уведомление отправляется вне критического пути
+            task = asyncio.create_task(self._notify_unlocked(user_id, achievement_type))
+            self._pending_notifications.add(task)
+            task.add_done_callback(self._pending_notifications.discard)
+            return True
             
-            # Отправляем уведомление
+        except Exception as e:
+            logger.error(f"Error unlocking achievement: {str(e)}")
+            return False
+
+    async def _notify_unlocked(self, user_id: str, achievement_type: AchievementType):
+        """Отправить уведомление о новом достижении"""
+        try:
             achievement = self.ACHIEVEMENTS[achievement_type]
             await notification_manager.send_notification(
                 user_id=user_id,
@@ -240,12 +376,12 @@ class AchievementManager:
                 priority=NotificationPriority.MEDIUM,
                 data={
                     "achievement_type": achievement_type.value,
-                    "points": points
+                    "points": achievement["points"]
                 }
             )
             
         except Exception as e:
-            logger.error(f"Error unlocking achievement: {str(e)}")
+            logger.error(f"Error sending achievement notification: {str(e)}")
 
     async def update_progress(
         self,
@@ -272,6 +408,7 @@ class AchievementManager:
                 target_value=achievement["progress_max"]
             )
             await redis.set(progress_key, progress.json())
+            await self._invalidate_view(user_id)
             
             # Если достигнут максимум, разблокируем достижение
             if value >= achievement["progress_max"]:
@@ -280,131 +417,185 @@ class AchievementManager:
         except Exception as e:
             logger.error(f"Error updating achievement progress: {str(e)}")
 
-    async def _handle_game_finished(self, event: GameEvent):
-        """Обработчик завершения игры"""
+    async def _handle_event(self, event: GameEvent):
+        """Обработчик игровых событий для индексированных правил"""
         try:
-            winner_id = event.data.get("winner_id")
-            if not winner_id:
+            rules = self.rule_index.get(event.event_type, ())
+            matched = [
+                (rule, subject)
+                for rule in rules
+                if rule.predicate is None or rule.predicate(event)
+                for subject in rule.subjects(event)
+            ]
+            resets = {
+                (subject, rule.counter)
+                for rule in rules
+                if rule.counter and rule.resets
+                for subject in rule.resets(event)
+            }
+            if not matched and not resets:
                 return
-                
-            # Проверяем первую победу
-            await self._check_first_win(winner_id)
-            
-            # Проверяем победную серию
-            await self._check_winning_streak(winner_id)
-            
-            # Проверяем быструю победу
-            game_duration = event.data.get("duration")
-            if game_duration and game_duration < 120:  # менее 2 минут
-                await self.unlock_achievement(winner_id, AchievementType.FAST_WIN)
-                
-            # Проверяем безупречную игру
-            errors = event.data.get("errors", 0)
-            if errors == 0:
-                await self.unlock_achievement(winner_id, AchievementType.PERFECT_GAME)
-                
-            # Обновляем статистику игр
-            await self._update_games_stats(winner_id)
-            
-        except Exception as e:
-            logger.error(f"Error handling game finished event: {str(e)}")
 
-    async def _handle_chat_message(self, event: GameEvent):
-        """Обработчик сообщений чата"""
-        try:
-            user_id = event.player_id
-            if not user_id:
-                return
-                
-            # Обновляем количество сообщений
+            # Все счетчики события увеличиваются и обнуляются одним пайплайном
+            counters: Dict[Tuple[str, str], int] = {}
+            for rule, subject in matched:
+                if rule.counter:
+                    counters.setdefault((subject, rule.counter), rule.increment)
+
             redis = await CacheManager.get_redis()
-            messages_count = await redis.hincrby(
-                f"user:{user_id}:stats",
-                "chat_messages",
-                1
-            )
-            
-            # Проверяем достижение общительности
-            await self.update_progress(
-                user_id,
-                AchievementType.SOCIAL_BUTTERFLY,
-                messages_count
-            )
-            
-        except Exception as e:
-            logger.error(f"Error handling chat message event: {str(e)}")
+            values: Dict[Tuple[str, str], int] = {}
+            if counters or resets:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for (subject, counter), increment in counters.items():
+                        pipe.hincrby(f"user:{subject}:stats", counter, increment)
+                    for subject, counter in resets:
+                        pipe.hset(f"user:{subject}:stats", counter, 0)
+                    values = dict(zip(counters, await pipe.execute()))
 
-    async def _handle_number_marked(self, event: GameEvent):
-        """Обработчик отмеченных чисел"""
-        try:
-            user_id = event.player_id
-            if not user_id:
-                return
-                
-            # Проверяем камбэк
-            game_state = event.data.get("game_state", {})
-            player_numbers = len(game_state.get("marked_numbers", {}).get(user_id, []))
-            leader_numbers = max(
-                len(numbers)
-                for player, numbers in game_state.get("marked_numbers", {}).items()
-                if player != user_id
-            )
-            
-            if leader_numbers - player_numbers >= 10:
-                await self.unlock_achievement(user_id, AchievementType.COMEBACK_KID)
-                
-        except Exception as e:
-            logger.error(f"Error handling number marked event: {str(e)}")
+            progress = []
+            unlocks = []
+            for rule, subject in matched:
+                if not rule.counter:
+                    unlocks.append((subject, rule.achievement_type))
+                    continue
 
-    async def _check_first_win(self, user_id: str):
-        """Проверка первой победы"""
-        try:
-            redis = await CacheManager.get_redis()
-            wins = await redis.hget(f"user:{user_id}:stats", "wins")
-            
-            if wins == "1":  # Первая победа
-                await self.unlock_achievement(user_id, AchievementType.FIRST_WIN)
-                
-        except Exception as e:
-            logger.error(f"Error checking first win: {str(e)}")
+                value = values[(subject, rule.counter)]
+                if rule.achievement_type in PROGRESS_ACHIEVEMENTS:
+                    progress.append((subject, rule.achievement_type, value))
+                if rule.is_reached(value):
+                    unlocks.append((subject, rule.achievement_type))
 
-    async def _check_winning_streak(self, user_id: str):
-        """Проверка победной серии"""
-        try:
-            redis = await CacheManager.get_redis()
-            streak_key = f"user:{user_id}:winning_streak"
-            
-            # Увеличиваем серию побед
-            streak = await redis.incr(streak_key)
-            
-            # Проверяем достижения
-            if streak >= 3:
-                await self.unlock_achievement(user_id, AchievementType.WINNING_STREAK_3)
-            if streak >= 5:
-                await self.unlock_achievement(user_id, AchievementType.WINNING_STREAK_5)
-                
-        except Exception as e:
-            logger.error(f"Error checking winning streak: {str(e)}")
+            if progress:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for subject, achievement_type, value in progress:
+                        pipe.set(
+                            f"user:{subject}:achievement_progress:{achievement_type.value}",
+                            AchievementProgress(
+                                achievement_type=achievement_type,
+                                current_value=value,
+                                target_value=ACHIEVEMENT_CATALOG[achievement_type].progress_max
+                            ).json()
+                        )
+                        pipe.incr(f"user:{subject}:achievements:version")
+                    await pipe.execute()
+
+            if unlocks:
+                await asyncio.gather(*(
+                    self.unlock_achievement(subject, achievement_type)
+                    for subject, achievement_type in unlocks
+                ))
 
-    async def _update_games_stats(self, user_id: str):
-        """Обновление игровой статистики"""
-        try:
-            redis = await CacheManager.get_redis()
-            
-            # Обновляем количество игр
-            games = await redis.hincrby(f"user:{user_id}:stats", "games_played", 1)
-            await self.update_progress(user_id, AchievementType.VETERAN, games)
-            
-            # Обновляем количество побед
-            wins = await redis.hincrby(f"user:{user_id}:stats", "wins", 1)
-            await self.update_progress(user_id, AchievementType.MASTER, wins)
-            
-            # Проверяем рейтинг
-            rating = int(await redis.hget(f"user:{user_id}:stats", "rating") or 0)
-            await self.update_progress(user_id, AchievementType.HIGH_ROLLER, rating)
-            
         except Exception as e:
-            logger.error(f"Error updating games stats: {str(e)}")
+            logger.error(f"Error handling {event.event_type} event: {str(e)}")
+
+# KEYS: достижения, статистика, версия кэша представления
+# ARGV: тип достижения, время разблокировки, очки
+UNLOCK_ACHIEVEMENT_SCRIPT = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[2], 'achievement_points', ARGV[3])
+redis.call('INCR', KEYS[3])
+return 1
+"""
+
+# Время жизни кэша представления достижений пользователя (секунды)
+ACHIEVEMENTS_VIEW_TTL = 300
+
+# Неизменяемый каталог достижений, собирается один раз при импорте
+ACHIEVEMENT_CATALOG = MappingProxyType({
+    ach_type: Achievement(type=ach_type, **AchievementManager.ACHIEVEMENTS[ach_type])
+    for ach_type in AchievementType
+})
+
+# Достижения с прогрессом, порядок совпадает с ключами в пайплайне
+PROGRESS_ACHIEVEMENTS = tuple(
+    ach_type for ach_type, achievement in ACHIEVEMENT_CATALOG.items()
+    if achievement.progress_max is not None
+)
+
+def _marked_deficit(event: GameEvent) -> int:
+    """Отставание игрока от лидера по отмеченным числам"""
+    return event.data.get("leader_count", 0) - event.data.get("marked_count", 0)
+
+# Декларативное описание достижений
+ACHIEVEMENT_RULES = (
+    # Игровые достижения
+    AchievementRule(
+        achievement_type=AchievementType.FIRST_WIN,
+        event_type=GameEventType.GAME_FINISHED,
+        subjects=_event_winner,
+        counter="wins",
+        threshold=1
+    ),
+    AchievementRule(
+        achievement_type=AchievementType.WINNING_STREAK_3,
+        event_type=GameEventType.GAME_FINISHED,
+        subjects=_event_winner,
+        counter="winning_streak",
+        threshold=3,
+        resets=_event_losers
+    ),
+    AchievementRule(
+        achievement_type=AchievementType.WINNING_STREAK_5,
+        event_type=GameEventType.GAME_FINISHED,
+        subjects=_event_winner,
+        counter="winning_streak",
+        threshold=5,
+        resets=_event_losers
+    ),
+    AchievementRule(
+        achievement_type=AchievementType.FAST_WIN,
+        event_type=GameEventType.GAME_FINISHED,
+        subjects=_event_winner,
+        predicate=lambda event: 0 < (event.data.get("duration") or 0) < 120  # менее 2 минут
+    ),
+    AchievementRule(
+        achievement_type=AchievementType.PERFECT_GAME,
+        event_type=GameEventType.GAME_FINISHED,
+        subjects=_event_winner,
+        predicate=lambda event: event.data.get("errors", 0) == 0
+    ),
+    AchievementRule(
+        achievement_type=AchievementType.COMEBACK_KID,
+        event_type=GameEventType.NUMBER_MARKED,
+        predicate=lambda event: _marked_deficit(event) >= 10
+    ),
+
+    # Социальные достижения
+    AchievementRule(
+        achievement_type=AchievementType.SOCIAL_BUTTERFLY,
+        event_type=GameEventType.CHAT_MESSAGE,
+        counter="chat_messages",
+        threshold=100
+    ),
+    AchievementRule(
+        achievement_type=AchievementType.POPULAR_PLAYER,
+        event_type=GameEventType.CHAT_REACTION,
+        counter="reactions_received",
+        threshold=50
+    ),
+
+    # Статистические достижения
+    AchievementRule(
+        achievement_type=AchievementType.VETERAN,
+        event_type=GameEventType.GAME_FINISHED,
+        subjects=_event_players,
+        counter="games_played",
+        threshold=100
+    ),
+    AchievementRule(
+        achievement_type=AchievementType.MASTER,
+        event_type=GameEventType.GAME_FINISHED,
+        subjects=_event_winner,
+        counter="wins",
+        threshold=50
+    ),
+)
+
+# HIGH_ROLLER не описывается правилом: рейтинг пересчитывает
+# ratings.update_ratings, он же и разблокирует достижение
+HIGH_ROLLER_RATING = ACHIEVEMENT_CATALOG[AchievementType.HIGH_ROLLER].progress_max
 
 # Создаем глобальный экземпляр менеджера достижений
 achievement_manager = AchievementManager() 
\ No newline at end of file
@@ -0,0 +1,220 @@
+"""Ретроактивное начисление достижений по истории из Postgres.
+
+Запуск: python -m app.core.backfill --chunk-size 1000 --pause 0.5
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import func, select
+from .achievements import (
+    ACHIEVEMENT_CATALOG,
+    ACHIEVEMENT_RULES,
+    HIGH_ROLLER_RATING,
+    PROGRESS_ACHIEVEMENTS,
+    UNLOCK_ACHIEVEMENT_SCRIPT,
+    AchievementProgress,
+    AchievementType
+)
+from .cache import CacheManager
+from .database import SessionLocal
+from .logging import logger
+from ..models.models import GameHistory, User
+
+# Быстрая победа, см. правило FAST_WIN
+FAST_WIN_SECONDS = 120
+
+# KEYS: статистика пользователя
+# ARGV: пары поле, значение
+# Счетчик не уменьшается: живая игра могла увеличить его после чтения из Postgres.
+# Возвращает итоговые значения полей в порядке ARGV
+MAX_COUNTERS_SCRIPT = """
+local merged = {}
+for i = 1, #ARGV, 2 do
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]))
+    local value = tonumber(ARGV[i + 1])
+    if not current or current < value then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+        current = value
+    end
+    merged[#merged + 1] = current
+end
+return merged
+"""
+
+# KEYS: статистика пользователя, прогресс достижения
+# ARGV: счетчик, его значение, прогресс в JSON
+# Прогресс пишется, только пока счетчик не изменился: иначе живая игра
+# уже записала (или запишет) более свежий прогресс сама
+SET_PROGRESS_SCRIPT = """
+if tonumber(redis.call('HGET', KEYS[1], ARGV[1])) ~= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[3])
+return 1
+"""
+
+def _build_query():
+    """Пользователи со статистикой и самой быстрой победой"""
+    fastest = (
+        select(
+            GameHistory.winner_id.label("user_id"),
+            func.min(GameHistory.duration).label("fastest_win")
+        )
+        .group_by(GameHistory.winner_id)
+        .subquery()
+    )
+    return (
+        select(
+            User.id,
+            User.games_played,
+            User.games_won,
+            User.rating,
+            fastest.c.fastest_win
+        )
+        .outerjoin(fastest, fastest.c.user_id == User.id)
+        .order_by(User.id)
+    )
+
+def row_counters(row) -> Dict[str, int]:
+    """Счетчики статистики по строке истории"""
+    return {
+        "games_played": row.games_played or 0,
+        "wins": row.games_won or 0,
+        "rating": row.rating or 0
+    }
+
+def compute_user_state(counters: Dict[str, int], fastest_win: Optional[int]) -> Dict:
+    """Рассчитать прогресс и разблокировки по счетчикам пользователя.
+
+    Прогресс возвращается как достижение -> счетчик, по которому он считается.
+    """
+    progress: Dict[AchievementType, str] = {}
+    unlocks: List[AchievementType] = []
+    for rule in ACHIEVEMENT_RULES:
+        if rule.counter not in counters or rule.threshold is None:
+            continue
+        if rule.achievement_type in PROGRESS_ACHIEVEMENTS:
+            progress[rule.achievement_type] = rule.counter
+        if counters[rule.counter] >= rule.threshold:
+            unlocks.append(rule.achievement_type)
+
+    # Для рейтинга правила нет, см. HIGH_ROLLER_RATING
+    progress[AchievementType.HIGH_ROLLER] = "rating"
+    if counters["rating"] >= HIGH_ROLLER_RATING:
+        unlocks.append(AchievementType.HIGH_ROLLER)
+
+    if fastest_win is not None and 0 < fastest_win < FAST_WIN_SECONDS:
+        unlocks.append(AchievementType.FAST_WIN)
+
+    return {"progress": progress, "unlocks": unlocks}
+
+async def _write_chunk(redis, scripts: Dict, rows, unlocked_at: str) -> int:
+    """Записать состояние пачки пользователей.
+
+    Первый пайплайн сливает счетчики из Postgres с живыми, второй пишет
+    прогресс и разблокировки по слитым значениям, поэтому прогресс не
+    откатывается ниже того, что успела насчитать живая игра.
+    """
+    users = [(str(row.id), row_counters(row), row.fastest_win) for row in rows]
+    async with redis.pipeline(transaction=False) as pipe:
+        for user_id, counters, _ in users:
+            await scripts["counters"](
+                keys=[f"user:{user_id}:stats"],
+                args=[item for pair in counters.items() for item in pair],
+                client=pipe
+            )
+        merged = await pipe.execute()
+
+    unlocks = []
+    async with redis.pipeline(transaction=False) as pipe:
+        for (user_id, counters, fastest_win), values in zip(users, merged):
+            counters = dict(zip(counters, (int(value) for value in values)))
+            state = compute_user_state(counters, fastest_win)
+
+            for achievement_type, counter in state["progress"].items():
+                await scripts["progress"](
+                    keys=[
+                        f"user:{user_id}:stats",
+                        f"user:{user_id}:achievement_progress:{achievement_type.value}"
+                    ],
+                    args=[
+                        counter,
+                        counters[counter],
+                        AchievementProgress(
+                            achievement_type=achievement_type,
+                            current_value=counters[counter],
+                            target_value=ACHIEVEMENT_CATALOG[achievement_type].progress_max
+                        ).json()
+                    ],
+                    client=pipe
+                )
+            pipe.incr(f"user:{user_id}:achievements:version")
+            unlocks.extend((user_id, achievement_type) for achievement_type in state["unlocks"])
+
+        # Разблокировки идут последними, чтобы посчитать новые по хвосту результатов
+        for user_id, achievement_type in unlocks:
+            await scripts["unlock"](
+                keys=[
+                    f"user:{user_id}:achievements",
+                    f"user:{user_id}:stats",
+                    f"user:{user_id}:achievements:version"
+                ],
+                args=[
+                    achievement_type.value,
+                    unlocked_at,
+                    ACHIEVEMENT_CATALOG[achievement_type].points
+                ],
+                client=pipe
+            )
+
+        results = await pipe.execute()
+
+    return sum(results[len(results) - len(unlocks):]) if unlocks else 0
+
+async def backfill_achievements(chunk_size: int = 1000, pause: float = 0.5):
+    """Пересчитать достижения по всей истории.
+
+    Postgres читается серверным курсором пачками по `chunk_size` строк,
+    каждая пачка пишется в Redis одним пайплайном, между пачками выдерживается
+    пауза `pause` секунд, чтобы не мешать живому трафику. Уведомления о
+    ретроактивных достижениях не отправляются.
+    """
+    redis = await CacheManager.get_redis()
+    scripts = {
+        "counters": redis.register_script(MAX_COUNTERS_SCRIPT),
+        "progress": redis.register_script(SET_PROGRESS_SCRIPT),
+        "unlock": redis.register_script(UNLOCK_ACHIEVEMENT_SCRIPT)
+    }
+    unlocked_at = datetime.now().isoformat()
+
+    db = SessionLocal()
+    users = unlocked = 0
+    try:
+        result = db.execute(
+            _build_query().execution_options(stream_results=True, max_row_buffer=chunk_size)
+        )
+        for rows in result.partitions(chunk_size):
+            unlocked += await _write_chunk(redis, scripts, rows, unlocked_at)
+            users += len(rows)
+            logger.info(f"Achievement backfill: {users} users processed, {unlocked} achievements unlocked")
+            await asyncio.sleep(pause)
+    finally:
+        db.close()
+
+    logger.info(f"Achievement backfill finished: {users} users, {unlocked} achievements unlocked")
+    return users, unlocked
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill achievements from game history")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.5, help="seconds to sleep between chunks")
+    args = parser.parse_args()
+
+    async def main():
+        try:
+            await backfill_achievements(args.chunk_size, args.pause)
+        finally:
+            await CacheManager.close()
+
+    asyncio.run(main())
@@ -1,10 +1,14 @@
 from datetime import datetime
 from typing import List, Optional, Dict
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from .cache import CacheManager
 from .logging import logger
 from .events import event_manager, GameEvent, GameEventType
-import json
+from .moderation import moderation_engine
+from .notifications import notification_manager, NotificationType
+from .users import user_directory
+from .chat_archive import chat_archiver, parse_stream_id, CHAT_GAMES_KEY
+import asyncio
 import re
 
 class ChatMessage(BaseModel):
@@ -12,79 +16,250 @@ class ChatMessage(BaseModel):
     game_id: str
     player_id: str
     content: str
-    timestamp: datetime = datetime.now()
+    timestamp: datetime = Field(default_factory=datetime.now)
     type: str = "message"  # message, system, moderated
     status: str = "sent"  # sent, delivered, read
     mentions: List[str] = []
     reactions: Dict[str, List[str]] = {}  # emoji: [player_ids]
+    reaction_counts: Dict[str, int] = {}  # emoji: count
+    stream_id: Optional[str] = None  # Redis stream entry id, used as history cursor
+
+class ChatHistoryPage(BaseModel):
+    messages: List[ChatMessage]
+    next_cursor: Optional[str] = None  # pass as before_id to load older messages
 
 class ChatManager:
-    def __init__(self):
-        self.bad_words_pattern = re.compile(r'\b(bad|words|here)\b', re.IGNORECASE)
-        
+    def __init__(self, batch_size: int = 100, flush_interval: float = 0.05):
+        self.moderation = moderation_engine
+        self._reaction_script = None
+
+        # Write-behind buffer: messages are broadcast first and persisted in batches
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "asyncio.Queue[ChatMessage]" = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+        # Batch the writer has taken off the queue but not yet persisted
+        self._pending: List[ChatMessage] = []
+        self._persisting: Optional[asyncio.Future] = None
+
     async def send_message(self, message: ChatMessage):
-        """Send a chat message"""
+        """Send a chat message.
+
+        The message is moderated and returned immediately; storage, event
+        publication and mention notifications happen in the write-behind
+        batch shortly after.
+        """
         try:
-            # Moderate content
-            moderated_content = await self.moderate_message(message.content)
-            if moderated_content != message.content:
-                message.type = "moderated"
-                message.content = moderated_content
-            
-            # Extract mentions
-            message.mentions = self._extract_mentions(message.content)
-            
-            # Store in Redis
-            redis = await CacheManager.get_redis()
-            await redis.lpush(
-                f"game:{message.game_id}:chat",
-                message.json()
-            )
-            
-            # Publish event
-            await event_manager.publish_event(GameEvent(
-                event_type=GameEventType.CHAT_MESSAGE,
-                game_id=message.game_id,
-                player_id=message.player_id,
-                data=message.dict()
-            ))
-            
-            # Handle mentions notifications
-            await self._handle_mentions(message)
-            
+            await self.prepare_message(message)
+            self.enqueue_message(message)
             return message
             
         except Exception as e:
             logger.error(f"Error sending chat message: {str(e)}")
             raise
 
+    async def prepare_message(self, message: ChatMessage) -> ChatMessage:
+        """Moderate content and extract mentions"""
+        moderated_content = await self.moderate_message(message.content)
+        if moderated_content != message.content:
+            message.type = "moderated"
+            message.content = moderated_content
+        
+        message.mentions = self._extract_mentions(message.content)
+        return message
+
+    def enqueue_message(self, message: ChatMessage):
+        """Queue a prepared message for batched persistence"""
+        self._queue.put_nowait(message)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_behind())
+
+    async def flush(self):
+        """Stop the writer and persist everything still buffered, e.g. on shutdown"""
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        if self._persisting is not None:
+            await self._persisting
+            self._persisting = None
+
+        # The writer's half-collected batch goes first to keep message order
+        batch, self._pending = self._pending, []
+        while batch or not self._queue.empty():
+            await self._persist_batch(self._take_batch(batch))
+            batch = []
+
+    def _take_batch(self, batch: List[ChatMessage]) -> List[ChatMessage]:
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _write_behind(self):
+        while True:
+            self._pending.append(await self._queue.get())
+            # Give a burst a moment to accumulate into one batch
+            await asyncio.sleep(self.flush_interval)
+            batch, self._pending = self._take_batch(self._pending), []
+            # Shielded: cancelling the writer never interrupts a batch halfway
+            self._persisting = asyncio.ensure_future(self._persist_batch(batch))
+            await asyncio.shield(self._persisting)
+            self._persisting = None
+
+    async def _persist_batch(self, batch: List[ChatMessage]):
+        """Store, publish and notify for a batch of messages"""
+        if not batch:
+            return
+        try:
+            redis = await CacheManager.get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                for message in batch:
+                    pipe.xadd(
+                        self._stream_key(message.game_id),
+                        {"message_id": message.message_id, "data": message.json(exclude={"stream_id"})}
+                    )
+                    # Message author lookup for reactions
+                    pipe.hset(f"game:{message.game_id}:chat:authors", message.message_id, message.player_id)
+                    # Picked up by the archiver once the game outgrows the hot window
+                    pipe.sadd(CHAT_GAMES_KEY, message.game_id)
+                results = await pipe.execute()
+            for message, stream_id in zip(batch, results[::3]):
+                message.stream_id = stream_id
+
+            await event_manager.publish_events([
+                GameEvent(
+                    event_type=GameEventType.CHAT_MESSAGE,
+                    game_id=message.game_id,
+                    player_id=message.player_id,
+                    data=message.dict()
+                )
+                for message in batch
+            ])
+
+            await self._handle_mentions(batch)
+
+        except Exception as e:
+            logger.error(f"Error persisting chat messages: {str(e)}")
+
     async def get_messages(
         self,
         game_id: str,
         limit: int = 50,
+        before_id: Optional[str] = None,
         before_timestamp: Optional[datetime] = None
-    ) -> List[ChatMessage]:
-        """Get chat messages for a game"""
+    ) -> ChatHistoryPage:
+        """Get one page of chat history, newest first.
+
+        `before_id` is the `next_cursor` of the previous page; exactly one
+        page is read from the stream and only its entries are decoded.
+        Once the hot history in Redis is exhausted the page continues from
+        the Postgres archive with the same cursor.
+        """
         try:
+            if before_id:
+                max_id = self._previous_stream_id(before_id)
+            elif before_timestamp:
+                max_id = str(int(before_timestamp.timestamp() * 1000) - 1)
+            else:
+                max_id = "+"
+
             redis = await CacheManager.get_redis()
-            messages = await redis.lrange(
-                f"game:{game_id}:chat",
-                0,
-                limit - 1
+            entries = await redis.xrevrange(
+                self._stream_key(game_id),
+                max=max_id,
+                min="-",
+                count=limit
             )
             
-            result = []
-            for msg in messages:
-                message = ChatMessage(**json.loads(msg))
-                if before_timestamp and message.timestamp >= before_timestamp:
-                    continue
-                result.append(message)
-                
-            return result
+            messages = [self._decode_entry(stream_id, fields) for stream_id, fields in entries]
+            await self._attach_reactions(redis, game_id, messages)
+
+            if len(messages) < limit:
+                if messages:
+                    archive_before = parse_stream_id(messages[-1].stream_id)
+                elif before_id:
+                    archive_before = parse_stream_id(before_id)
+                elif before_timestamp:
+                    archive_before = (int(before_timestamp.timestamp() * 1000), 0)
+                else:
+                    archive_before = None
+                try:
+                    archived = await chat_archiver.get_archived(game_id, limit - len(messages), archive_before)
+                    messages.extend(self._decode_archived(row) for row in archived)
+                except Exception as e:
+                    # Hot history is still served if the archive is unavailable
+                    logger.error(f"Error reading archived chat messages: {str(e)}")
+            next_cursor = messages[-1].stream_id if len(messages) == limit else None
+            return ChatHistoryPage(messages=messages, next_cursor=next_cursor)
             
         except Exception as e:
             logger.error(f"Error getting chat messages: {str(e)}")
-            return []
+            return ChatHistoryPage(messages=[])
+
+    @staticmethod
+    def _stream_key(game_id: str) -> str:
+        return f"game:{game_id}:chat:stream"
+
+    @staticmethod
+    def _decode_archived(row) -> ChatMessage:
+        reactions = row.reactions or {}
+        return ChatMessage(
+            message_id=row.message_id,
+            game_id=row.game_id,
+            player_id=row.player_id,
+            content=row.content,
+            timestamp=row.created_at,
+            type=row.type,
+            mentions=row.mentions or [],
+            reactions=reactions,
+            reaction_counts={emoji: len(players) for emoji, players in reactions.items()},
+            stream_id=f"{row.stream_ms}-{row.stream_seq}"
+        )
+
+    @staticmethod
+    def _reaction_keys(game_id: str, message_id: str):
+        return (
+            f"game:{game_id}:chat:reactions:{message_id}",
+            f"game:{game_id}:chat:reactors:{message_id}"
+        )
+
+    async def _attach_reactions(self, redis, game_id: str, messages: List[ChatMessage]):
+        """Load reactions for a page of messages in one round trip"""
+        if not messages:
+            return
+        async with redis.pipeline(transaction=False) as pipe:
+            for message in messages:
+                counts_key, reactors_key = self._reaction_keys(game_id, message.message_id)
+                pipe.hgetall(counts_key)
+                pipe.smembers(reactors_key)
+            results = await pipe.execute()
+
+        for i, message in enumerate(messages):
+            counts, reactors = results[2 * i], results[2 * i + 1]
+            message.reaction_counts = {emoji: int(count) for emoji, count in counts.items()}
+            reactions: Dict[str, List[str]] = {}
+            for reactor in reactors:
+                emoji, _, player_id = reactor.rpartition(":")
+                reactions.setdefault(emoji, []).append(player_id)
+            message.reactions = reactions
+
+    @staticmethod
+    def _previous_stream_id(stream_id: str) -> str:
+        """Largest stream id strictly below `stream_id` (inclusive range bound)"""
+        ms, _, seq = stream_id.partition("-")
+        if seq and int(seq) > 0:
+            return f"{ms}-{int(seq) - 1}"
+        # Incomplete id "ms" as an upper bound covers every sequence of that ms
+        return str(int(ms) - 1)
+
+    @staticmethod
+    def _decode_entry(stream_id: str, fields: Dict[str, str]) -> ChatMessage:
+        message = ChatMessage.parse_raw(fields["data"])
+        message.stream_id = stream_id
+        return message
 
     async def add_reaction(
         self,
@@ -92,57 +267,100 @@ class ChatManager:
         message_id: str,
         player_id: str,
         emoji: str
-    ):
-        """Add reaction to a message"""
+    ) -> bool:
+        """Add reaction to a message.
+
+        Reactor set and per-emoji counter are updated atomically in one
+        script, so concurrent reactions are never lost. Returns True if the
+        reaction is new.
+        """
         try:
             redis = await CacheManager.get_redis()
-            message_key = f"game:{game_id}:chat:message:{message_id}"
-            
-            # Get message
-            message_data = await redis.get(message_key)
-            if not message_data:
-                return
-                
-            message = ChatMessage(**json.loads(message_data))
-            
-            # Add reaction
-            if emoji not in message.reactions:
-                message.reactions[emoji] = []
-            if player_id not in message.reactions[emoji]:
-                message.reactions[emoji].append(player_id)
-                
-            # Save updated message
-            await redis.set(message_key, message.json())
+            if self._reaction_script is None:
+                self._reaction_script = redis.register_script(ADD_REACTION_SCRIPT)
+
+            counts_key, reactors_key = self._reaction_keys(game_id, message_id)
+            author_id = await self._reaction_script(
+                keys=[f"game:{game_id}:chat:authors", counts_key, reactors_key],
+                args=[message_id, emoji, player_id]
+            )
+            if author_id is None:
+                return False
+
+            # Reactions to your own messages do not count towards POPULAR_PLAYER
+            if author_id != player_id:
+                await event_manager.publish_event(GameEvent(
+                    event_type=GameEventType.CHAT_REACTION,
+                    game_id=game_id,
+                    player_id=author_id,
+                    data={
+                        "message_id": message_id,
+                        "emoji": emoji,
+                        "from_player": player_id
+                    }
+                ))
+            return True
             
         except Exception as e:
             logger.error(f"Error adding reaction: {str(e)}")
+            return False
 
     async def moderate_message(self, content: str) -> str:
         """Moderate message content"""
-        # Replace bad words with asterisks
-        return self.bad_words_pattern.sub(lambda m: '*' * len(m.group()), content)
+        # Pick up word list changes without a restart
+        await self.moderation.maybe_reload()
+        return self.moderation.moderate(content)
 
     def _extract_mentions(self, content: str) -> List[str]:
         """Extract @mentions from message"""
         mentions = re.findall(r'@(\w+)', content)
         return list(set(mentions))
 
-    async def _handle_mentions(self, message: ChatMessage):
-        """Handle notifications for mentioned users"""
-        for mentioned_user in message.mentions:
-            # Add notification
-            redis = await CacheManager.get_redis()
-            notification = {
-                "type": "mention",
-                "game_id": message.game_id,
-                "message_id": message.message_id,
-                "from_user": message.player_id,
-                "timestamp": message.timestamp.isoformat()
-            }
-            await redis.lpush(
-                f"user:{mentioned_user}:notifications",
-                json.dumps(notification)
-            )
+    async def _handle_mentions(self, messages: List[ChatMessage]):
+        """Handle notifications for users mentioned in a batch of messages"""
+        usernames = {username for message in messages for username in message.mentions}
+        if not usernames:
+            return
+
+        try:
+            # All mentions of the batch are resolved with one lookup
+            user_ids = await user_directory.resolve(usernames)
+            notifications = [
+                notification_manager.build_notification(
+                    user_id=user_ids[username],
+                    type=NotificationType.CHAT_MENTION,
+                    title="Вас упомянули в чате",
+                    message=message.content,
+                    data={
+                        "game_id": message.game_id,
+                        "message_id": message.message_id,
+                        "from_user": message.player_id,
+                        "timestamp": message.timestamp.isoformat()
+                    }
+                )
+                for message in messages
+                for username in message.mentions
+                if username in user_ids and user_ids[username] != message.player_id
+            ]
+            await notification_manager.send_bulk_notifications(notifications)
+
+        except Exception as e:
+            logger.error(f"Error handling chat mentions: {str(e)}")
+
+# KEYS: message authors, reaction counts, reactors
+# ARGV: message id, emoji, player id
+# Returns the message author for a new reaction, nil otherwise
+ADD_REACTION_SCRIPT = """
+local author = redis.call('HGET', KEYS[1], ARGV[1])
+if not author then
+    return nil
+end
+if redis.call('SADD', KEYS[3], ARGV[2] .. ':' .. ARGV[3]) == 0 then
+    return nil
+end
+redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+return author
+"""
 
 # Create global chat manager instance
 chat_manager = ChatManager() 
\ No newline at end of file
@@ -0,0 +1,215 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import and_, insert, or_
+from starlette.concurrency import run_in_threadpool
+import csv
+import io
+import json
+import os
+from .cache import CacheManager
+from .database import SessionLocal, engine
+from .logging import logger
+from ..models.models import ChatMessageArchive
+
+# Number of most recent messages per game kept in Redis
+CHAT_HOT_MESSAGES = int(os.getenv("CHAT_HOT_MESSAGES", "200"))
+# Messages moved to Postgres per batch
+CHAT_ARCHIVE_BATCH = int(os.getenv("CHAT_ARCHIVE_BATCH", "1000"))
+
+# Games with chat history in Redis, and finished games whose chat is archived in full
+CHAT_GAMES_KEY = "chat:games"
+CHAT_CLOSED_GAMES_KEY = "chat:closed_games"
+
+COPY_COLUMNS = (
+    "game_id", "stream_ms", "stream_seq", "message_id", "player_id",
+    "content", "type", "mentions", "reactions", "created_at"
+)
+
+def parse_stream_id(stream_id: str) -> Tuple[int, int]:
+    ms, _, seq = stream_id.partition("-")
+    return int(ms), int(seq or 0)
+
+class ChatArchiver:
+    """Moves chat history beyond the hot window from Redis to Postgres.
+
+    Redis keeps the last CHAT_HOT_MESSAGES entries of each game stream.
+    Older entries are written to the chat_messages table in large batches
+    (COPY on PostgreSQL) and then trimmed from the stream together with
+    their reaction keys. Chat of closed games is archived in full.
+    """
+
+    async def archive_all(self):
+        """Archive every game with chat history in Redis"""
+        redis = await CacheManager.get_redis()
+        closed = await redis.smembers(CHAT_CLOSED_GAMES_KEY)
+        async for game_id in redis.sscan_iter(CHAT_GAMES_KEY):
+            try:
+                await self.archive_game(game_id, keep=0 if game_id in closed else CHAT_HOT_MESSAGES)
+            except Exception as e:
+                logger.error(f"Error archiving chat of game {game_id}: {str(e)}")
+
+    async def archive_game(self, game_id: str, keep: int = CHAT_HOT_MESSAGES) -> int:
+        """Archive all but the `keep` most recent messages of a game"""
+        redis = await CacheManager.get_redis()
+        stream_key = f"game:{game_id}:chat:stream"
+        archived = 0
+
+        excess = await redis.xlen(stream_key) - keep
+        if excess > 0:
+            # Entries already in Postgres are skipped if a previous run died before trimming
+            last_archived = await run_in_threadpool(self._last_archived_id, game_id)
+
+        while excess > 0:
+            entries = await redis.xrange(stream_key, min="-", max="+", count=min(excess, CHAT_ARCHIVE_BATCH))
+            if not entries:
+                break
+
+            rows = await self._build_rows(redis, game_id, entries, last_archived)
+            if rows:
+                await run_in_threadpool(self._write_rows, rows)
+
+            last_id = entries[-1][0]
+            ms, seq = parse_stream_id(last_id)
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.xtrim(stream_key, minid=f"{ms}-{seq + 1}")
+                for _, fields in entries:
+                    message_id = fields["message_id"]
+                    pipe.delete(
+                        f"game:{game_id}:chat:reactions:{message_id}",
+                        f"game:{game_id}:chat:reactors:{message_id}"
+                    )
+                    pipe.hdel(f"game:{game_id}:chat:authors", message_id)
+                await pipe.execute()
+
+            archived += len(entries)
+            excess -= len(entries)
+
+        if keep == 0:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.delete(stream_key, f"game:{game_id}:chat:authors")
+                pipe.srem(CHAT_GAMES_KEY, game_id)
+                pipe.srem(CHAT_CLOSED_GAMES_KEY, game_id)
+                await pipe.execute()
+
+        if archived:
+            logger.info(f"Archived {archived} chat messages of game {game_id}")
+        return archived
+
+    async def _build_rows(
+        self,
+        redis,
+        game_id: str,
+        entries: List[Tuple[str, Dict[str, str]]],
+        last_archived: Optional[Tuple[int, int]]
+    ) -> List[Dict]:
+        entries = [
+            (stream_id, fields) for stream_id, fields in entries
+            if last_archived is None or parse_stream_id(stream_id) > last_archived
+        ]
+        if not entries:
+            return []
+
+        # Reaction snapshot for the whole batch in one round trip
+        async with redis.pipeline(transaction=False) as pipe:
+            for _, fields in entries:
+                pipe.smembers(f"game:{game_id}:chat:reactors:{fields['message_id']}")
+            reactors = await pipe.execute()
+
+        rows = []
+        for (stream_id, fields), message_reactors in zip(entries, reactors):
+            data = json.loads(fields["data"])
+            reactions: Dict[str, List[str]] = {}
+            for reactor in message_reactors:
+                emoji, _, player_id = reactor.rpartition(":")
+                reactions.setdefault(emoji, []).append(player_id)
+
+            ms, seq = parse_stream_id(stream_id)
+            rows.append({
+                "game_id": game_id,
+                "stream_ms": ms,
+                "stream_seq": seq,
+                "message_id": data["message_id"],
+                "player_id": data["player_id"],
+                "content": data["content"],
+                "type": data.get("type", "message"),
+                "mentions": data.get("mentions", []),
+                "reactions": reactions,
+                "created_at": datetime.fromisoformat(data["timestamp"])
+            })
+        return rows
+
+    def _last_archived_id(self, game_id: str) -> Optional[Tuple[int, int]]:
+        db = SessionLocal()
+        try:
+            row = (
+                db.query(ChatMessageArchive.stream_ms, ChatMessageArchive.stream_seq)
+                .filter(ChatMessageArchive.game_id == game_id)
+                .order_by(ChatMessageArchive.stream_ms.desc(), ChatMessageArchive.stream_seq.desc())
+                .first()
+            )
+            return (row.stream_ms, row.stream_seq) if row else None
+        finally:
+            db.close()
+
+    def _write_rows(self, rows: List[Dict]):
+        """Bulk insert archived messages, using COPY on PostgreSQL"""
+        if engine.dialect.name != "postgresql":
+            with engine.begin() as conn:
+                conn.execute(insert(ChatMessageArchive.__table__), rows)
+            return
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                json.dumps(row[column]) if column in ("mentions", "reactions") else row[column]
+                for column in COPY_COLUMNS
+            ])
+        buffer.seek(0)
+
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY chat_messages ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+    async def get_archived(
+        self,
+        game_id: str,
+        limit: int,
+        before: Optional[Tuple[int, int]] = None
+    ) -> List[ChatMessageArchive]:
+        """Read one page of archived messages older than the cursor, newest first"""
+        return await run_in_threadpool(self._query_archived, game_id, limit, before)
+
+    def _query_archived(
+        self,
+        game_id: str,
+        limit: int,
+        before: Optional[Tuple[int, int]]
+    ) -> List[ChatMessageArchive]:
+        db = SessionLocal()
+        try:
+            query = db.query(ChatMessageArchive).filter(ChatMessageArchive.game_id == game_id)
+            if before:
+                ms, seq = before
+                query = query.filter(or_(
+                    ChatMessageArchive.stream_ms < ms,
+                    and_(ChatMessageArchive.stream_ms == ms, ChatMessageArchive.stream_seq < seq)
+                ))
+            return (
+                query
+                .order_by(ChatMessageArchive.stream_ms.desc(), ChatMessageArchive.stream_seq.desc())
+                .limit(limit)
+                .all()
+            )
+        finally:
+            db.close()
+
+# Create global chat archiver instance
+chat_archiver = ChatArchiver()
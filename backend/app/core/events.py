@@ -1,5 +1,5 @@
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 from .cache import CacheManager
@@ -27,12 +27,13 @@ class GameEventType(str, Enum):
     # Chat events
     CHAT_MESSAGE = "chat_message"
     CHAT_MODERATED = "chat_moderated"
+    CHAT_REACTION = "chat_reaction"
 
 class GameEvent(BaseModel):
     event_type: GameEventType
     game_id: str
     player_id: Optional[str]
-    timestamp: datetime = datetime.now()
+    timestamp: datetime = Field(default_factory=datetime.now)
     data: Dict[str, Any]
 
 class EventManager:
@@ -45,7 +46,7 @@ class EventManager:
             redis = await CacheManager.get_redis()
             
             # Store event in Redis
-            event_data = event.dict()
+            event_data = event.json()
             await redis.lpush(f"game:{event.game_id}:events", event_data)
             
             # Notify subscribers
@@ -63,6 +64,29 @@ class EventManager:
         except Exception as e:
             logger.error(f"Error publishing event: {str(e)}")
 
+    async def publish_events(self, events: List[GameEvent]):
+        """Publish a batch of events with one Redis round trip"""
+        if not events:
+            return
+        try:
+            redis = await CacheManager.get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                for event in events:
+                    event_data = event.json()
+                    pipe.lpush(f"game:{event.game_id}:events", event_data)
+                    pipe.publish(f"game:{event.game_id}", event_data)
+                await pipe.execute()
+
+            logger.info(f"Game events published: {len(events)} events")
+
+            # Notify local subscribers
+            for event in events:
+                for callback in self.subscribers.get(event.event_type, []):
+                    await callback(event)
+
+        except Exception as e:
+            logger.error(f"Error publishing events: {str(e)}")
+
     def subscribe(self, event_type: GameEventType, callback: callable):
         """Subscribe to specific event type"""
         if event_type not in self.subscribers:
@@ -74,7 +98,7 @@ class EventManager:
         try:
             redis = await CacheManager.get_redis()
             events = await redis.lrange(f"game:{game_id}:events", 0, limit - 1)
-            return [GameEvent(**event) for event in events]
+            return [GameEvent.parse_raw(event) for event in events]
         except Exception as e:
             logger.error(f"Error getting game events: {str(e)}")
             return []
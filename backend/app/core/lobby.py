@@ -0,0 +1,61 @@
+from typing import Optional, Set
+from fastapi import WebSocket
+import asyncio
+import json
+from .cache import CacheManager
+from .logging import logger
+from ..services.redis_service import LOBBY_CHANNEL
+
+class LobbyRelay:
+    """Fan lobby updates published by any worker out to local lobby sockets.
+
+    Each worker holds one subscription to the lobby channel no matter how
+    many lobby sockets it serves.
+    """
+
+    def __init__(self):
+        self.connections: Set[WebSocket] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        self.connections.add(websocket)
+
+    def disconnect(self, websocket: WebSocket):
+        self.connections.discard(websocket)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _listen(self):
+        while True:
+            try:
+                redis = await CacheManager.get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(LOBBY_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    await self._broadcast(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in lobby listener: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _broadcast(self, data: str):
+        payload = json.loads(data)
+        for websocket in list(self.connections):
+            try:
+                await websocket.send_json(payload)
+            except Exception:
+                self.disconnect(websocket)
+
+# Create global lobby relay instance
+lobby_relay = LobbyRelay()
\ No newline at end of file
@@ -0,0 +1,286 @@
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+from uuid import uuid4
+from starlette.concurrency import run_in_threadpool
+import aiosmtplib
+import asyncio
+import json
+import os
+from .cache import CacheManager
+from .database import SessionLocal
+from .logging import logger
+from ..models.models import User
+
+EMAIL_QUEUE_KEY = "notifications:email:queue"
+EMAIL_RETRY_KEY = "notifications:email:retry"  # sorted set scored by next attempt time
+EMAIL_DEAD_KEY = "notifications:email:dead"
+EMAIL_WORKERS_KEY = "notifications:email:workers"  # worker id -> last heartbeat
+EMAIL_WORKER_TIMEOUT = 300  # seconds without a heartbeat before a worker's jobs are requeued
+
+def _processing_key(worker_id: str) -> str:
+    return f"notifications:email:processing:{worker_id}"
+
+def _env_flag(name: str, default: Optional[bool]) -> Optional[bool]:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+class SMTPPool:
+    """Small pool of authenticated SMTP connections reused across emails"""
+
+    def __init__(self, config: Dict, size: int = 2):
+        self.config = config
+        self.size = size
+        self._idle: List[aiosmtplib.SMTP] = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=self.config["hostname"],
+            port=self.config["port"],
+            username=self.config["username"],
+            password=self.config["password"],
+            use_tls=self.config["use_tls"],
+            start_tls=self.config["start_tls"]
+        )
+        await client.connect()
+        return client
+
+    async def send(self, message: EmailMessage):
+        """Send through an idle connection, reconnecting if it went stale"""
+        async with self._semaphore:
+            client = self._idle.pop() if self._idle else None
+            try:
+                if client is None or not client.is_connected:
+                    client = await self._connect()
+                await client.send_message(message)
+            except Exception:
+                if client is not None:
+                    client.close()
+                raise
+            self._idle.append(client)
+
+    async def close(self):
+        while self._idle:
+            client = self._idle.pop()
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+class EmailQueue:
+    """Outbound email queue drained by a background worker.
+
+    Callers only LPUSH a job, so notification senders never wait on the
+    mail relay. The worker sends batches over pooled SMTP connections,
+    retries failures with exponential backoff and moves jobs that keep
+    failing to a dead-letter list. Claimed jobs are moved to a per-worker
+    processing list and removed only once their outcome is recorded; the
+    processing list of a worker that stops heartbeating is requeued, so a
+    crash mid-batch delays emails instead of losing them. Point
+    SMTP_HOST/SMTP_PORT at a local stand-in such as aiosmtpd to exercise
+    it without a real relay (see tests/test_mailer.py).
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 50,
+        max_attempts: int = 5,
+        retry_base_delay: float = 30.0
+    ):
+        self.config = {
+            "hostname": os.getenv("SMTP_HOST", "smtp.example.com"),
+            "port": int(os.getenv("SMTP_PORT", "587")),
+            "username": os.getenv("SMTP_USERNAME") or None,
+            "password": os.getenv("SMTP_PASSWORD") or None,
+            "use_tls": _env_flag("SMTP_USE_TLS", True),
+            "start_tls": _env_flag("SMTP_START_TLS", None),
+            "sender": os.getenv("SMTP_FROM", "noreply@bingogame.com")
+        }
+        self.pool = SMTPPool(self.config, size=int(os.getenv("SMTP_POOL_SIZE", "2")))
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.worker_id = uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+        self._promote_script = None
+        self._claim_script = None
+        self._requeue_script = None
+
+    async def enqueue(self, user_id: str, subject: str, body: str):
+        """Queue an email to a user"""
+        redis = await CacheManager.get_redis()
+        await redis.lpush(EMAIL_QUEUE_KEY, json.dumps({
+            "user_id": str(user_id),
+            "subject": subject,
+            "body": body,
+            "attempts": 0
+        }))
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            # Jobs this worker claimed but did not finish go back to the queue
+            try:
+                redis = await CacheManager.get_redis()
+                await self._requeue(redis, self.worker_id, datetime.now().timestamp())
+            except Exception as e:
+                logger.error(f"Error requeueing claimed emails: {str(e)}")
+        await self.pool.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.process_batch(block_timeout=1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in email worker: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def process_batch(self, block_timeout: int = 0) -> int:
+        """Send one batch of queued emails; returns how many were sent"""
+        redis = await CacheManager.get_redis()
+        await self._heartbeat(redis)
+        await self._promote_due_retries(redis)
+
+        processing_key = _processing_key(self.worker_id)
+        if self._claim_script is None:
+            self._claim_script = redis.register_script(CLAIM_JOBS_SCRIPT)
+        raw_jobs = await self._claim_script(
+            keys=[EMAIL_QUEUE_KEY, processing_key],
+            args=[self.batch_size]
+        )
+        if not raw_jobs and block_timeout:
+            popped = await redis.brpoplpush(EMAIL_QUEUE_KEY, processing_key, timeout=block_timeout)
+            raw_jobs = [popped] if popped else []
+        if not raw_jobs:
+            return 0
+
+        jobs = [json.loads(raw) for raw in raw_jobs]
+        emails = await run_in_threadpool(self._get_user_emails, {job["user_id"] for job in jobs})
+
+        results = await asyncio.gather(
+            *(self._send(job, emails.get(job["user_id"])) for job in jobs),
+            return_exceptions=True
+        )
+
+        sent = 0
+        # Outcomes and acks are written together, so a job is never both
+        # rescheduled and left in the processing list
+        async with redis.pipeline(transaction=True) as pipe:
+            for raw, job, result in zip(raw_jobs, jobs, results):
+                pipe.lrem(processing_key, 1, raw)
+                if not isinstance(result, Exception):
+                    sent += result
+                    continue
+                job["attempts"] += 1
+                job["error"] = str(result)
+                if job["attempts"] >= self.max_attempts:
+                    logger.error(f"Email to user {job['user_id']} dead-lettered: {result}")
+                    pipe.lpush(EMAIL_DEAD_KEY, json.dumps(job))
+                else:
+                    delay = self.retry_base_delay * 2 ** (job["attempts"] - 1)
+                    pipe.zadd(EMAIL_RETRY_KEY, {json.dumps(job): datetime.now().timestamp() + delay})
+            await pipe.execute()
+        return sent
+
+    async def _send(self, job: Dict, address: Optional[str]) -> int:
+        if not address:
+            return 0
+        message = EmailMessage()
+        message["From"] = self.config["sender"]
+        message["To"] = address
+        message["Subject"] = job["subject"]
+        message.set_content(job["body"])
+        await self.pool.send(message)
+        return 1
+
+    async def _heartbeat(self, redis):
+        """Refresh this worker's heartbeat and requeue jobs of dead workers"""
+        now = datetime.now().timestamp()
+        await redis.zadd(EMAIL_WORKERS_KEY, {self.worker_id: now})
+        cutoff = now - EMAIL_WORKER_TIMEOUT
+        for worker_id in await redis.zrangebyscore(EMAIL_WORKERS_KEY, "-inf", cutoff):
+            requeued = await self._requeue(redis, worker_id, cutoff)
+            if requeued:
+                logger.warning(f"Requeued {requeued} emails claimed by stopped worker {worker_id}")
+
+    async def _requeue(self, redis, worker_id: str, cutoff) -> int:
+        if self._requeue_script is None:
+            self._requeue_script = redis.register_script(REQUEUE_JOBS_SCRIPT)
+        return await self._requeue_script(
+            keys=[EMAIL_WORKERS_KEY, _processing_key(worker_id), EMAIL_QUEUE_KEY],
+            args=[worker_id, cutoff]
+        )
+
+    async def _promote_due_retries(self, redis):
+        if self._promote_script is None:
+            self._promote_script = redis.register_script(PROMOTE_RETRIES_SCRIPT)
+        await self._promote_script(
+            keys=[EMAIL_RETRY_KEY, EMAIL_QUEUE_KEY],
+            args=[datetime.now().timestamp(), self.batch_size]
+        )
+
+    def _get_user_emails(self, user_ids) -> Dict[str, str]:
+        ids = [int(user_id) for user_id in user_ids if str(user_id).isdigit()]
+        if not ids:
+            return {}
+        db = SessionLocal()
+        try:
+            rows = db.query(User.id, User.email).filter(User.id.in_(ids)).all()
+            return {str(user_id): email for user_id, email in rows}
+        finally:
+            db.close()
+
+# KEYS: retry set, queue
+# ARGV: now, max jobs to move
+PROMOTE_RETRIES_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('LPUSH', KEYS[2], job)
+end
+return #due
+"""
+
+# KEYS: queue, processing list
+# ARGV: max jobs to claim
+CLAIM_JOBS_SCRIPT = """
+local jobs = {}
+for i = 1, tonumber(ARGV[1]) do
+    local job = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+    if not job then
+        break
+    end
+    jobs[i] = job
+end
+return jobs
+"""
+
+# KEYS: workers, processing list of the worker, queue
+# ARGV: worker id, heartbeat cutoff
+# The heartbeat is checked again here, so a worker that came back after
+# the caller read the workers set keeps its jobs
+REQUEUE_JOBS_SCRIPT = """
+local heartbeat = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if heartbeat and tonumber(heartbeat) > tonumber(ARGV[2]) then
+    return 0
+end
+local count = 0
+while redis.call('RPOPLPUSH', KEYS[2], KEYS[3]) do
+    count = count + 1
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+return count
+"""
+
+# Create global email queue instance
+email_queue = EmailQueue()
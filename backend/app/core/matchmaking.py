@@ -0,0 +1,236 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import json
+import os
+from .cache import CacheManager
+from .database import SessionLocal
+from .logging import logger
+from .presence import presence_manager
+from ..services.game_service import GameService
+from ..services.redis_service import RedisService
+
+MATCHMAKING_QUEUE_KEY = "matchmaking:queue"      # sorted set of players scored by rating
+MATCHMAKING_WAITING_KEY = "matchmaking:waiting"  # player -> enqueue timestamp
+# Game a player was matched into, polled through GET /game/matchmaking
+MATCHMAKING_ASSIGNMENT_TTL = int(os.getenv("MATCHMAKING_ASSIGNMENT_TTL", "600"))
+
+# Players are matched within rating buckets of this width
+MATCHMAKING_BUCKET_SIZE = int(os.getenv("MATCHMAKING_BUCKET_SIZE", "200"))
+# After this many seconds a player may be matched into a smaller game or the next bucket
+MATCHMAKING_MAX_WAIT = float(os.getenv("MATCHMAKING_MAX_WAIT", "30"))
+MATCH_SIZE = 4
+
+class MatchmakingQueue:
+    """Queue of players waiting for a game, drained by a batch worker.
+
+    Every tick the worker reads the queue in rating order, splits it into
+    rating buckets and claims full groups atomically, so several workers
+    can run side by side without matching a player twice.
+
+    Each matched player gets `matchmaking:assigned:{id}` with the game id.
+    A full group's game is started by the worker right away; a smaller
+    overdue group's game stays open in the lobby and is started by its
+    creator, the first player of the group.
+    """
+
+    def __init__(self, interval: float = 1.0, batch_size: int = 1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.redis_service = RedisService()
+        self._task: Optional[asyncio.Task] = None
+        self._claim_script = None
+
+    @staticmethod
+    def _assignment_key(user_id) -> str:
+        return f"matchmaking:assigned:{user_id}"
+
+    async def enqueue(self, user_id: int, rating: int):
+        """Add a player to the queue, keeping their original wait time"""
+        redis = await CacheManager.get_redis()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(MATCHMAKING_QUEUE_KEY, {user_id: rating})
+            pipe.hsetnx(MATCHMAKING_WAITING_KEY, user_id, datetime.now().timestamp())
+            # A previous match is no longer the answer once the player queues again
+            pipe.delete(self._assignment_key(user_id))
+            await pipe.execute()
+
+    async def get_status(self, user_id: int) -> Optional[Dict]:
+        """The game a player was matched into, or that they are still queued.
+
+        Returns None if the player is neither queued nor matched.
+        """
+        redis = await CacheManager.get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(self._assignment_key(user_id))
+            pipe.zscore(MATCHMAKING_QUEUE_KEY, user_id)
+            assignment, score = await pipe.execute()
+        if assignment:
+            return {"status": "matched", **json.loads(assignment)}
+        if score is not None:
+            return {"status": "queued"}
+        return None
+
+    async def dequeue(self, user_id: int) -> bool:
+        """Remove a player from the queue; returns whether they were queued"""
+        redis = await CacheManager.get_redis()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(MATCHMAKING_QUEUE_KEY, user_id)
+            pipe.hdel(MATCHMAKING_WAITING_KEY, user_id)
+            removed, _ = await pipe.execute()
+        return bool(removed)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in matchmaking worker: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def form_groups(self, queued: List[Tuple[str, float]], waiting: Dict[str, float]) -> List[List[str]]:
+        """Split players ordered by rating into groups of up to MATCH_SIZE.
+
+        Full groups are formed inside a bucket. Leftovers who waited longer
+        than MATCHMAKING_MAX_WAIT carry over into the adjacent bucket; an
+        overdue remainder that can't carry over forms a smaller game if it
+        has at least two players.
+        """
+        now = datetime.now().timestamp()
+        buckets: Dict[int, List[str]] = {}
+        for player, rating in queued:
+            buckets.setdefault(int(rating // MATCHMAKING_BUCKET_SIZE), []).append(player)
+
+        groups = []
+        carried: List[str] = []
+        previous = None
+        for bucket in sorted(buckets):
+            if carried and bucket != previous + 1:
+                if len(carried) >= 2:
+                    groups.append(carried)
+                carried = []
+            previous = bucket
+
+            players = carried + buckets[bucket]
+            full = len(players) - len(players) % MATCH_SIZE
+            groups.extend(players[i:i + MATCH_SIZE] for i in range(0, full, MATCH_SIZE))
+
+            leftovers = players[full:]
+            overdue = any(now - waiting.get(player, now) >= MATCHMAKING_MAX_WAIT for player in leftovers)
+            carried = leftovers if overdue else []
+
+        if len(carried) >= 2:
+            groups.append(carried)
+        return groups
+
+    async def process_batch(self) -> int:
+        """Form games from the queue; returns how many were created"""
+        redis = await CacheManager.get_redis()
+        if self._claim_script is None:
+            self._claim_script = redis.register_script(CLAIM_PLAYERS_SCRIPT)
+
+        queued = await redis.zrange(MATCHMAKING_QUEUE_KEY, 0, self.batch_size - 1, withscores=True)
+        if len(queued) < 2:
+            return 0
+        waiting = dict(zip(
+            (player for player, _ in queued),
+            await redis.hmget(MATCHMAKING_WAITING_KEY, [player for player, _ in queued])
+        ))
+        groups = self.form_groups(queued, {
+            player: float(enqueued) for player, enqueued in waiting.items() if enqueued
+        })
+        if not groups:
+            return 0
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for group in groups:
+                await self._claim_script(
+                    keys=[MATCHMAKING_QUEUE_KEY, MATCHMAKING_WAITING_KEY],
+                    args=group,
+                    client=pipe
+                )
+            claims = await pipe.execute()
+        claimed = [group for group, ok in zip(groups, claims) if ok]
+        if not claimed:
+            return 0
+
+        ratings = dict(queued)
+        try:
+            games = await run_in_threadpool(self._create_games, claimed)
+        except Exception:
+            # Put the players back so they are matched on the next tick
+            async with redis.pipeline(transaction=False) as pipe:
+                for group in claimed:
+                    pipe.zadd(MATCHMAKING_QUEUE_KEY, {player: ratings[player] for player in group})
+                    pipe.hset(MATCHMAKING_WAITING_KEY, mapping={
+                        player: waiting[player] or datetime.now().timestamp() for player in group
+                    })
+                await pipe.execute()
+            raise
+
+        assignments = [
+            (group, {
+                "game_id": game_id,
+                "players": [int(member) for member in group],
+                "started": started
+            })
+            for group, (game_id, started) in zip(claimed, games)
+        ]
+        async with redis.pipeline(transaction=False) as pipe:
+            for group, assignment in assignments:
+                for player in group:
+                    pipe.setex(self._assignment_key(player), MATCHMAKING_ASSIGNMENT_TTL, json.dumps(assignment))
+            await pipe.execute()
+
+        # Players with an open socket learn about the match right away, the rest poll for it
+        for group, assignment in assignments:
+            for player in group:
+                await presence_manager.push(player, {"type": "match_found", **assignment})
+        logger.info(f"Matchmaking created {len(games)} games")
+        return len(games)
+
+    def _create_games(self, groups: List[List[str]]) -> List[Tuple[int, bool]]:
+        """Create a game per group; returns (game id, started) for each"""
+        db = SessionLocal()
+        try:
+            game_service = GameService(db, self.redis_service)
+            games = []
+            for group in groups:
+                game = game_service.create_matched_game([int(player) for player in group], MATCH_SIZE)
+                started = False
+                if len(group) == MATCH_SIZE:
+                    started, _ = game_service.start_game(game.id)
+                games.append((game.id, started))
+            return games
+        finally:
+            db.close()
+
+# KEYS: queue, waiting times
+# ARGV: players of one group
+CLAIM_PLAYERS_SCRIPT = """
+for _, player in ipairs(ARGV) do
+    if not redis.call('ZSCORE', KEYS[1], player) then
+        return 0
+    end
+end
+for _, player in ipairs(ARGV) do
+    redis.call('ZREM', KEYS[1], player)
+    redis.call('HDEL', KEYS[2], player)
+end
+return 1
+"""
+
+# Create global matchmaking queue instance
+matchmaking_queue = MatchmakingQueue()
\ No newline at end of file
@@ -0,0 +1,191 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import time
+from .cache import CacheManager
+from .logging import logger
+
+# Leetspeak substitutions folded before matching
+LEET_MAP = {
+    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t",
+    "@": "a", "$": "s"
+}
+
+# Cyrillic letters that look like Latin ones are folded to Latin, so
+# mixed-script spellings match the same pattern
+HOMOGLYPH_MAP = {
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h",
+    "о": "o", "р": "p", "с": "c", "т": "t", "у": "y", "х": "x"
+}
+
+NORMALIZATION_TABLE = str.maketrans({**LEET_MAP, **HOMOGLYPH_MAP})
+
+DEFAULT_WORDS = ("bad", "words", "here")
+
+def normalize(text: str) -> str:
+    """Fold case, leetspeak and homoglyphs without changing the text length"""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Some characters lowercase to several code points; keep positions aligned
+        lowered = "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+    return lowered.translate(NORMALIZATION_TABLE)
+
+class Automaton:
+    """Aho-Corasick automaton over normalized patterns.
+
+    A pattern matches whole words only. A pattern ending in `*` is a word
+    stem: it must start at a word boundary and the match is extended to
+    the end of the word, so one stem covers its inflections.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Tuple[Tuple[int, bool], ...]] = [()]  # (length, is stem)
+
+        for pattern in patterns:
+            pattern = pattern.strip()
+            stem = pattern.endswith("*")
+            pattern = normalize(pattern.rstrip("*"))
+            if pattern:
+                self._add(pattern, stem)
+        self._build_failure_links()
+
+    def _add(self, pattern: str, stem: bool):
+        state = 0
+        for ch in pattern:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][ch] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state = next_state
+        if (len(pattern), stem) not in self.out[state]:
+            self.out[state] += ((len(pattern), stem),)
+
+    def _build_failure_links(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                # Longest matches first, then those reachable via the failure link
+                self.out[next_state] += self.out[self.fail[next_state]]
+
+    def find(self, normalized: str) -> List[Tuple[int, int]]:
+        """Return (start, end) spans of matched words in a normalized text"""
+        goto, fail, out = self.goto, self.fail, self.out
+        root = goto[0]
+        size = len(normalized)
+        spans = []
+        state = 0
+        for i, ch in enumerate(normalized):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0) if state else root.get(ch, 0)
+            if out[state]:
+                word_ends = i + 1 == size or not normalized[i + 1].isalnum()
+                for length, stem in out[state]:
+                    start = i - length + 1
+                    if start and normalized[start - 1].isalnum():
+                        continue
+                    if not stem and not word_ends:
+                        continue
+                    end = i + 1
+                    # A stem covers the rest of the word
+                    while stem and end < size and normalized[end].isalnum():
+                        end += 1
+                    spans.append((start, end))
+                    break
+        return spans
+
+class ModerationEngine:
+    """Multi-pattern chat filter with hot-reloadable word lists.
+
+    Words come from `MODERATION_WORDS_FILE` when set, otherwise from the
+    Redis set `moderation:words`. Bumping the file mtime or the
+    `moderation:words:version` key swaps in a freshly built automaton on
+    the next check, without a restart.
+    """
+
+    WORDS_KEY = "moderation:words"
+    VERSION_KEY = "moderation:words:version"
+
+    def __init__(
+        self,
+        words: Iterable[str] = DEFAULT_WORDS,
+        words_file: Optional[str] = None,
+        reload_interval: float = 30.0
+    ):
+        self.words_file = words_file
+        self.reload_interval = reload_interval
+        self._automaton = Automaton(words)
+        self._version: Optional[str] = None
+        self._next_check = 0.0
+
+    def load(self, words: Iterable[str]):
+        """Build a new automaton and swap it in atomically"""
+        automaton = Automaton(words)
+        self._automaton = automaton
+        logger.info(f"Moderation word list loaded: {len(automaton.goto)} automaton states")
+
+    def load_from_file(self, path: str):
+        """Load one word or `stem*` per line; blank lines and # comments are skipped"""
+        with open(path, encoding="utf-8") as f:
+            self.load(
+                line for line in (raw.strip() for raw in f)
+                if line and not line.startswith("#")
+            )
+
+    async def load_from_redis(self):
+        """Load the word list from the moderation:words set"""
+        redis = await CacheManager.get_redis()
+        words = await redis.smembers(self.WORDS_KEY)
+        if words:
+            self.load(words)
+
+    async def maybe_reload(self):
+        """Reload the word list if its source changed since the last check"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+
+        try:
+            if self.words_file:
+                version = str(os.path.getmtime(self.words_file))
+                if version != self._version:
+                    self.load_from_file(self.words_file)
+                    self._version = version
+            else:
+                redis = await CacheManager.get_redis()
+                version = await redis.get(self.VERSION_KEY)
+                if version and version != self._version:
+                    await self.load_from_redis()
+                    self._version = version
+        except Exception as e:
+            logger.error(f"Error reloading moderation word list: {str(e)}")
+
+    def moderate(self, content: str) -> str:
+        """Replace matched words with asterisks"""
+        normalized = normalize(content)
+        spans = self._automaton.find(normalized)
+        if not spans:
+            return content
+
+        chars = list(content)
+        masked_until = 0
+        for start, end in spans:
+            start = max(start, masked_until)
+            for i in range(start, end):
+                if not chars[i].isspace():
+                    chars[i] = "*"
+            masked_until = max(masked_until, end)
+        return "".join(chars)
+
+# Create global moderation engine instance
+moderation_engine = ModerationEngine(words_file=os.getenv("MODERATION_WORDS_FILE"))
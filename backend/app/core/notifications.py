@@ -1,12 +1,14 @@
 from datetime import datetime
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from enum import Enum
+from uuid import uuid4
+import json
+import os
 from .cache import CacheManager
 from .logging import logger
-import json
-import aiosmtplib
-from email.message import EmailMessage
+from .presence import presence_manager
+from .mailer import email_queue
 
 class NotificationType(str, Enum):
     GAME_INVITATION = "game_invitation"
@@ -17,6 +19,7 @@ class NotificationType(str, Enum):
     ACHIEVEMENT_UNLOCKED = "achievement_unlocked"
     FRIEND_REQUEST = "friend_request"
     SYSTEM_NOTIFICATION = "system_notification"
+    DIGEST = "digest"
 
 class NotificationPriority(str, Enum):
     LOW = "low"
@@ -37,19 +40,79 @@ class Notification(BaseModel):
     message: str
     priority: NotificationPriority = NotificationPriority.MEDIUM
     status: NotificationStatus = NotificationStatus.PENDING
-    timestamp: datetime = datetime.now()
+    timestamp: datetime = Field(default_factory=datetime.now)
     data: Optional[Dict[str, Any]] = None
     read_at: Optional[datetime] = None
 
+# Low and medium priority notifications are grouped per user within this window (seconds)
+DIGEST_WINDOW = int(os.getenv("NOTIFICATION_DIGEST_WINDOW", "60"))
+# Maximum number of notifications kept in a user's inbox
+INBOX_LIMIT = int(os.getenv("NOTIFICATION_INBOX_LIMIT", "200"))
+
+DIGEST_DUE_KEY = "notifications:digest:due"
+
+PRIORITY_ORDER = [NotificationPriority.LOW, NotificationPriority.MEDIUM, NotificationPriority.HIGH]
+
 class NotificationManager:
     def __init__(self):
-        self.email_config = {
-            "hostname": "smtp.example.com",
-            "port": 587,
-            "username": "your-username",
-            "password": "your-password"
+        self._mark_read_script = None
+        self._mark_all_read_script = None
+        self._trim_script = None
+        self._claim_digests_script = None
+
+    @staticmethod
+    def _keys(user_id: str) -> Dict[str, str]:
+        """Inbox keys: items by id, timeline by time, unread ids, read timestamps"""
+        prefix = f"user:{user_id}:notifications"
+        return {
+            "items": f"{prefix}:items",
+            "timeline": f"{prefix}:timeline",
+            "unread": f"{prefix}:unread",
+            "read": f"{prefix}:read"
         }
 
+    async def _store(self, notifications: List[Notification]):
+        """Store notifications in one pipeline and trim the affected inboxes"""
+        redis = await CacheManager.get_redis()
+        if self._trim_script is None:
+            self._trim_script = redis.register_script(TRIM_INBOX_SCRIPT)
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for notification in notifications:
+                keys = self._keys(notification.user_id)
+                pipe.hset(keys["items"], notification.id, notification.json())
+                pipe.zadd(keys["timeline"], {notification.id: notification.timestamp.timestamp()})
+                pipe.sadd(keys["unread"], notification.id)
+
+            for user_id in {notification.user_id for notification in notifications}:
+                keys = self._keys(user_id)
+                await self._trim_script(
+                    keys=[keys["timeline"], keys["items"], keys["unread"], keys["read"]],
+                    args=[INBOX_LIMIT],
+                    client=pipe
+                )
+            await pipe.execute()
+
+    def build_notification(
+        self,
+        user_id: str,
+        type: NotificationType,
+        title: str,
+        message: str,
+        priority: NotificationPriority = NotificationPriority.MEDIUM,
+        data: Optional[Dict[str, Any]] = None
+    ) -> Notification:
+        """Create a notification without sending it"""
+        return Notification(
+            id=f"notif_{uuid4().hex}",
+            type=type,
+            user_id=user_id,
+            title=title,
+            message=message,
+            priority=priority,
+            data=data
+        )
+
     async def send_notification(
         self,
         user_id: str,
@@ -59,57 +122,133 @@ class NotificationManager:
         priority: NotificationPriority = NotificationPriority.MEDIUM,
         data: Optional[Dict[str, Any]] = None
     ) -> Notification:
-        """Send a notification to a user"""
+        """Send a notification to a user.
+
+        High priority notifications are stored and delivered immediately;
+        low and medium ones are coalesced into a per-user digest.
+        """
         try:
-            notification = Notification(
-                id=f"notif_{datetime.now().timestamp()}",
-                type=type,
-                user_id=user_id,
-                title=title,
-                message=message,
-                priority=priority,
-                data=data
-            )
-            
-            # Store in Redis
-            redis = await CacheManager.get_redis()
-            await redis.lpush(
-                f"user:{user_id}:notifications",
-                notification.json()
-            )
-            
-            # Send real-time notification if user is online
-            if await self._is_user_online(user_id):
-                await self._send_websocket_notification(user_id, notification)
-            
-            # Send email for high priority notifications
-            if priority == NotificationPriority.HIGH:
-                await self._send_email_notification(user_id, notification)
-            
+            notification = self.build_notification(user_id, type, title, message, priority, data)
+            await self.send_bulk_notifications([notification])
             return notification
             
         except Exception as e:
             logger.error(f"Error sending notification: {str(e)}")
             raise
 
+    async def send_bulk_notifications(self, notifications: List[Notification]) -> List[Notification]:
+        """Send a batch of notifications with one pipeline per delivery path"""
+        if not notifications:
+            return notifications
+        try:
+            immediate = [n for n in notifications if n.priority == NotificationPriority.HIGH]
+            deferred = [n for n in notifications if n.priority != NotificationPriority.HIGH]
+
+            if immediate:
+                await self._store(immediate)
+                for notification in immediate:
+                    await self._deliver(notification)
+
+            if deferred:
+                await self._enqueue_digest(deferred)
+            return notifications
+
+        except Exception as e:
+            logger.error(f"Error sending bulk notifications: {str(e)}")
+            raise
+
+    async def _enqueue_digest(self, notifications: List[Notification]):
+        """Hold notifications until the user's digest window closes"""
+        redis = await CacheManager.get_redis()
+        due_at = datetime.now().timestamp() + DIGEST_WINDOW
+        async with redis.pipeline(transaction=False) as pipe:
+            for notification in notifications:
+                pipe.rpush(f"user:{notification.user_id}:notifications:pending", notification.json())
+                # The first notification of a window sets its deadline
+                pipe.zadd(DIGEST_DUE_KEY, {notification.user_id: due_at}, nx=True)
+            await pipe.execute()
+
+    async def flush_digests(self, limit: int = 500) -> int:
+        """Store and deliver digests whose window has closed; returns how many"""
+        redis = await CacheManager.get_redis()
+        if self._claim_digests_script is None:
+            self._claim_digests_script = redis.register_script(CLAIM_DIGESTS_SCRIPT)
+
+        # Claiming removes users from the due set, so concurrent workers never share one
+        user_ids = await self._claim_digests_script(
+            keys=[DIGEST_DUE_KEY],
+            args=[datetime.now().timestamp(), limit]
+        )
+        if not user_ids:
+            return 0
+
+        async with redis.pipeline(transaction=True) as pipe:
+            for user_id in user_ids:
+                pending_key = f"user:{user_id}:notifications:pending"
+                pipe.lrange(pending_key, 0, -1)
+                pipe.delete(pending_key)
+            results = await pipe.execute()
+
+        digests = []
+        for user_id, pending in zip(user_ids, results[::2]):
+            items = [Notification.parse_raw(raw) for raw in pending]
+            if items:
+                digests.append(self._build_digest(user_id, items))
+
+        if digests:
+            await self._store(digests)
+            for digest in digests:
+                await self._deliver(digest)
+        return len(digests)
+
+    def _build_digest(self, user_id: str, items: List[Notification]) -> Notification:
+        if len(items) == 1:
+            return items[0]
+        return self.build_notification(
+            user_id=user_id,
+            type=NotificationType.DIGEST,
+            title=f"Новых уведомлений: {len(items)}",
+            message="\n".join(item.title for item in items),
+            priority=max((item.priority for item in items), key=PRIORITY_ORDER.index),
+            data={"items": [json.loads(item.json()) for item in items]}
+        )
+
+    async def _deliver(self, notification: Notification):
+        """Push a stored notification to the user's live channels"""
+        # Send real-time notification if user is online
+        await self._send_websocket_notification(notification.user_id, notification)
+        
+        # Send email for high priority notifications
+        if notification.priority == NotificationPriority.HIGH:
+            await self._send_email_notification(notification.user_id, notification)
+
     async def get_notifications(
         self,
         user_id: str,
         limit: int = 50,
         status: Optional[NotificationStatus] = None
     ) -> List[Notification]:
-        """Get user's notifications"""
+        """Get user's notifications, newest first"""
         try:
             redis = await CacheManager.get_redis()
-            notifications = await redis.lrange(
-                f"user:{user_id}:notifications",
-                0,
-                limit - 1
-            )
+            keys = self._keys(user_id)
+            ids = await redis.zrevrange(keys["timeline"], 0, limit - 1)
+            if not ids:
+                return []
+
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hmget(keys["items"], ids)
+                pipe.hmget(keys["read"], ids)
+                items, read_at = await pipe.execute()
             
             result = []
-            for notif in notifications:
-                notification = Notification(**json.loads(notif))
+            for item, item_read_at in zip(items, read_at):
+                if item is None:
+                    continue
+                notification = Notification.parse_raw(item)
+                if item_read_at:
+                    notification.status = NotificationStatus.READ
+                    notification.read_at = datetime.fromisoformat(item_read_at)
                 if status and notification.status != status:
                     continue
                 result.append(notification)
@@ -120,82 +259,130 @@ class NotificationManager:
             logger.error(f"Error getting notifications: {str(e)}")
             return []
 
-    async def mark_as_read(self, user_id: str, notification_id: str):
-        """Mark notification as read"""
+    async def get_unread_count(self, user_id: str) -> int:
+        """Get number of unread notifications"""
         try:
             redis = await CacheManager.get_redis()
-            key = f"user:{user_id}:notifications"
-            
-            # Get notification
-            notifications = await redis.lrange(key, 0, -1)
-            for i, notif in enumerate(notifications):
-                notification = Notification(**json.loads(notif))
-                if notification.id == notification_id:
-                    notification.status = NotificationStatus.READ
-                    notification.read_at = datetime.now()
-                    await redis.lset(key, i, notification.json())
-                    break
+            return await redis.scard(self._keys(user_id)["unread"])
+        except Exception as e:
+            logger.error(f"Error getting unread notifications count: {str(e)}")
+            return 0
+
+    async def mark_as_read(self, user_id: str, notification_id: str) -> bool:
+        """Mark notification as read in O(1); returns True if it was unread"""
+        try:
+            redis = await CacheManager.get_redis()
+            if self._mark_read_script is None:
+                self._mark_read_script = redis.register_script(MARK_READ_SCRIPT)
+
+            keys = self._keys(user_id)
+            marked = await self._mark_read_script(
+                keys=[keys["items"], keys["unread"], keys["read"]],
+                args=[notification_id, datetime.now().isoformat()]
+            )
+            return bool(marked)
                     
         except Exception as e:
             logger.error(f"Error marking notification as read: {str(e)}")
+            return False
+
+    async def mark_all_as_read(self, user_id: str) -> int:
+        """Mark every unread notification as read; returns how many were marked"""
+        try:
+            redis = await CacheManager.get_redis()
+            if self._mark_all_read_script is None:
+                self._mark_all_read_script = redis.register_script(MARK_ALL_READ_SCRIPT)
+
+            keys = self._keys(user_id)
+            return await self._mark_all_read_script(
+                keys=[keys["unread"], keys["read"]],
+                args=[datetime.now().isoformat()]
+            )
+
+        except Exception as e:
+            logger.error(f"Error marking all notifications as read: {str(e)}")
+            return 0
 
     async def _is_user_online(self, user_id: str) -> bool:
         """Check if user is online"""
-        redis = await CacheManager.get_redis()
-        return await redis.exists(f"user:{user_id}:websocket")
+        return await presence_manager.is_online(user_id)
 
     async def _send_websocket_notification(
         self,
         user_id: str,
         notification: Notification
-    ):
-        """Send notification via WebSocket"""
+    ) -> bool:
+        """Send notification via WebSocket; returns False if the user is offline"""
         try:
-            redis = await CacheManager.get_redis()
-            ws_connection = await redis.get(f"user:{user_id}:websocket")
-            if ws_connection:
-                # Send to WebSocket connection
-                pass
+            return await presence_manager.push(
+                user_id,
+                {"type": "notification", "notification": json.loads(notification.json())},
+                batch=True
+            )
                 
         except Exception as e:
             logger.error(f"Error sending WebSocket notification: {str(e)}")
+            return False
 
     async def _send_email_notification(
         self,
         user_id: str,
         notification: Notification
     ):
-        """Send notification via email"""
+        """Queue notification for email delivery"""
         try:
-            # Get user email
-            user_email = await self._get_user_email(user_id)
-            if not user_email:
-                return
-                
-            # Create email message
-            message = EmailMessage()
-            message["From"] = "noreply@bingogame.com"
-            message["To"] = user_email
-            message["Subject"] = notification.title
-            message.set_content(notification.message)
-            
-            # Send email
-            await aiosmtplib.send(
-                message,
-                hostname=self.email_config["hostname"],
-                port=self.email_config["port"],
-                username=self.email_config["username"],
-                password=self.email_config["password"],
-                use_tls=True
-            )
+            await email_queue.enqueue(user_id, notification.title, notification.message)
             
         except Exception as e:
-            logger.error(f"Error sending email notification: {str(e)}")
+            logger.error(f"Error queueing email notification: {str(e)}")
+
+# KEYS: items, unread ids, read timestamps
+# ARGV: notification id, read time
+MARK_READ_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSETNX', KEYS[3], ARGV[1], ARGV[2])
+return redis.call('SREM', KEYS[2], ARGV[1])
+"""
+
+# KEYS: unread ids, read timestamps
+# ARGV: read time
+MARK_ALL_READ_SCRIPT = """
+local ids = redis.call('SMEMBERS', KEYS[1])
+for _, id in ipairs(ids) do
+    redis.call('HSETNX', KEYS[2], id, ARGV[1])
+end
+redis.call('DEL', KEYS[1])
+return #ids
+"""
+
+# KEYS: timeline, items, unread ids, read timestamps
+# ARGV: inbox limit
+TRIM_INBOX_SCRIPT = """
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1])
+if excess <= 0 then
+    return 0
+end
+local ids = redis.call('ZRANGE', KEYS[1], 0, excess - 1)
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+for _, id in ipairs(ids) do
+    redis.call('HDEL', KEYS[2], id)
+    redis.call('SREM', KEYS[3], id)
+    redis.call('HDEL', KEYS[4], id)
+end
+return excess
+"""
 
-    async def _get_user_email(self, user_id: str) -> Optional[str]:
-        """Get user's email address"""
-        # Implementation depends on your user management system
-        pass
+# KEYS: digest due set
+# ARGV: now, max users to claim
+CLAIM_DIGESTS_SCRIPT = """
+local users = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, user in ipairs(users) do
+    redis.call('ZREM', KEYS[1], user)
+end
+return users
+"""
 
 # Create global notification manager instance
 notification_manager = NotificationManager() 
\ No newline at end of file
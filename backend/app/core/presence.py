@@ -0,0 +1,214 @@
+from typing import Any, Dict, List, Set
+from uuid import uuid4
+import asyncio
+import json
+import time
+from fastapi import WebSocket
+from .cache import CacheManager
+from .logging import logger
+
+class PresenceManager:
+    """Registry of live sockets across workers.
+
+    Each worker tracks its own sockets in memory and advertises them in
+    `user:{id}:presence`, a hash of worker id -> open socket count. Workers
+    heartbeat into the `presence:workers` sorted set; fields of a worker
+    without a recent heartbeat are ignored and pruned on lookup. Pushes
+    are published to the channels of the live workers holding the user's
+    sockets, and each worker forwards them to its local connections.
+    Bursty pushes to one user are coalesced into a single frame.
+    """
+
+    PRESENCE_TTL = 90
+    HEARTBEAT_INTERVAL = 30
+    WORKERS_KEY = "presence:workers"  # worker id -> last heartbeat
+
+    def __init__(self, batch_window: float = 0.1):
+        self.worker_id = uuid4().hex
+        self.batch_window = batch_window
+        self.connections: Dict[str, Set[WebSocket]] = {}
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        # References to pending batch flushes, so they are not garbage collected
+        self._flushes: Set[asyncio.Task] = set()
+        self._unregister_script = None
+
+    @staticmethod
+    def _presence_key(user_id) -> str:
+        return f"user:{user_id}:presence"
+
+    @staticmethod
+    def _channel(worker_id: str) -> str:
+        return f"presence:worker:{worker_id}"
+
+    async def register(self, user_id, websocket: WebSocket):
+        """Record an open socket of a user on this worker"""
+        user_id = str(user_id)
+        self.connections.setdefault(user_id, set()).add(websocket)
+        try:
+            redis = await CacheManager.get_redis()
+            key = self._presence_key(user_id)
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hincrby(key, self.worker_id, 1)
+                pipe.expire(key, self.PRESENCE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error registering presence: {str(e)}")
+
+    async def unregister(self, user_id, websocket: WebSocket):
+        """Forget a closed socket of a user"""
+        user_id = str(user_id)
+        sockets = self.connections.get(user_id)
+        if sockets is None or websocket not in sockets:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            self.connections.pop(user_id, None)
+        try:
+            redis = await CacheManager.get_redis()
+            if self._unregister_script is None:
+                self._unregister_script = redis.register_script(UNREGISTER_SCRIPT)
+            await self._unregister_script(keys=[self._presence_key(user_id)], args=[self.worker_id])
+        except Exception as e:
+            logger.error(f"Error unregistering presence: {str(e)}")
+
+    async def _live_workers(self, redis, user_id) -> List[str]:
+        """Workers holding sockets of the user that are still heartbeating"""
+        key = self._presence_key(user_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hkeys(key)
+            pipe.zrangebyscore(self.WORKERS_KEY, time.time() - self.PRESENCE_TTL, "+inf")
+            workers, live = await pipe.execute()
+
+        live = set(live)
+        stale = [worker_id for worker_id in workers if worker_id not in live]
+        if stale:
+            await redis.hdel(key, *stale)
+        return [worker_id for worker_id in workers if worker_id in live]
+
+    async def is_online(self, user_id) -> bool:
+        """Check if the user has an open socket on any live worker"""
+        redis = await CacheManager.get_redis()
+        return bool(await self._live_workers(redis, user_id))
+
+    async def push(self, user_id, payload: Dict[str, Any], batch: bool = False) -> bool:
+        """Send a payload to every live socket of a user.
+
+        With `batch=True` payloads arriving within the batch window are
+        delivered together as `{"type": "batch", "items": [...]}`; a
+        payload that arrives alone is delivered as is.
+        Returns False if the user is offline.
+        """
+        redis = await CacheManager.get_redis()
+        workers = await self._live_workers(redis, user_id)
+        if not workers:
+            return False
+
+        message = json.dumps({"user_id": str(user_id), "payload": payload, "batch": batch})
+        async with redis.pipeline(transaction=False) as pipe:
+            for worker_id in workers:
+                pipe.publish(self._channel(worker_id), message)
+            await pipe.execute()
+        return True
+
+    async def start(self):
+        """Start listening for pushes addressed to this worker"""
+        if self._tasks:
+            return
+        await self._refresh()
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._heartbeat())
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        try:
+            redis = await CacheManager.get_redis()
+            await redis.zrem(self.WORKERS_KEY, self.worker_id)
+        except Exception as e:
+            logger.error(f"Error removing worker presence: {str(e)}")
+
+    async def _listen(self):
+        while True:
+            try:
+                redis = await CacheManager.get_redis()
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(self._channel(self.worker_id))
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data["batch"]:
+                        self._buffer(data["user_id"], data["payload"])
+                    else:
+                        await self._send_local(data["user_id"], data["payload"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in presence listener: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            await self._refresh()
+
+    async def _refresh(self):
+        """Heartbeat this worker and keep presence of its local users alive.
+
+        A dead worker stops heartbeating, so its fields in the presence
+        hashes are treated as stale even while other workers refresh them.
+        """
+        try:
+            now = time.time()
+            redis = await CacheManager.get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.zadd(self.WORKERS_KEY, {self.worker_id: now})
+                pipe.zremrangebyscore(self.WORKERS_KEY, "-inf", now - self.PRESENCE_TTL)
+                for user_id, sockets in self.connections.items():
+                    pipe.hset(self._presence_key(user_id), self.worker_id, len(sockets))
+                    pipe.expire(self._presence_key(user_id), self.PRESENCE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error refreshing presence: {str(e)}")
+
+    def _buffer(self, user_id: str, payload: Dict[str, Any]):
+        pending = self._pending.get(user_id)
+        if pending is not None:
+            pending.append(payload)
+            return
+        self._pending[user_id] = [payload]
+        task = asyncio.create_task(self._flush_later(user_id))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush_later(self, user_id: str):
+        await asyncio.sleep(self.batch_window)
+        items = self._pending.pop(user_id, [])
+        if len(items) == 1:
+            await self._send_local(user_id, items[0])
+        elif items:
+            await self._send_local(user_id, {"type": "batch", "items": items})
+
+    async def _send_local(self, user_id: str, payload: Dict[str, Any]):
+        for websocket in list(self.connections.get(user_id, ())):
+            try:
+                await websocket.send_json(payload)
+            except Exception as e:
+                logger.error(f"Error pushing to WebSocket: {str(e)}")
+
+# KEYS: presence hash
+# ARGV: worker id
+UNREGISTER_SCRIPT = """
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+# Create global presence manager instance
+presence_manager = PresenceManager()
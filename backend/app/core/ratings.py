@@ -0,0 +1,181 @@
+"""Пакетный пересчет рейтинга Эло по завершенным играм.
+
+Игры обрабатываются пачками в порядке game_history.id, начиная с водяного
+знака в таблице rating_watermark. Водяной знак сдвигается в той же
+транзакции, что и запись рейтингов, поэтому сбой между ними не приводит
+к повторному учету игр. Внутри пачки все партии считаются по рейтингам
+на ее начало (рейтинговый период), поэтому расчет векторизуется по
+играм × игрокам.
+"""
+from typing import Dict, List, Tuple
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import Integer, column, select, update, values
+import asyncio
+import numpy as np
+import os
+from .achievements import HIGH_ROLLER_RATING, AchievementType, achievement_manager
+from .cache import CacheManager
+from .database import SessionLocal
+from .logging import logger
+from ..models.models import GameHistory, RatingWatermark, User, game_players
+from ..services.leaderboard_service import GLOBAL_LEADERBOARD_KEY
+
+# Прежний водяной знак в Redis, читается только для создания строки в Postgres
+LEGACY_WATERMARK_KEY = "ratings:watermark"
+RATING_K_FACTOR = float(os.getenv("RATING_K_FACTOR", "32"))
+RATING_BATCH_SIZE = int(os.getenv("RATING_BATCH_SIZE", "5000"))
+
+def compute_rating_deltas(
+    ratings: np.ndarray,
+    present: np.ndarray,
+    winners: np.ndarray,
+    k_factor: float = RATING_K_FACTOR
+) -> np.ndarray:
+    """Изменения рейтинга для матрицы игры × места.
+
+    Каждая игра раскладывается на попарные партии: победитель выигрывает
+    у всех соперников, остальные игроки между собой играют вничью.
+    Сумма результатов нормируется на число соперников.
+    """
+    # diff[g, i, j] = R_j - R_i
+    diff = ratings[:, None, :] - ratings[:, :, None]
+    expected = 1.0 / (1.0 + 10.0 ** (diff / 400.0))
+    score = np.where(winners[:, :, None], 1.0, np.where(winners[:, None, :], 0.0, 0.5))
+
+    pairs = present[:, :, None] & present[:, None, :]
+    pairs &= ~np.eye(ratings.shape[1], dtype=bool)
+    opponents = pairs.sum(axis=2)
+    total = np.where(pairs, score - expected, 0.0).sum(axis=2)
+    return k_factor * total / np.maximum(opponents, 1)
+
+def _load_batch(db, after_id: int, limit: int):
+    """Игры после водяного знака, их участники и текущие рейтинги"""
+    games = (
+        db.query(GameHistory.id, GameHistory.game_id, GameHistory.winner_id)
+        .filter(GameHistory.id > after_id)
+        .order_by(GameHistory.id)
+        .limit(limit)
+        .all()
+    )
+    if not games:
+        return games, {}, {}
+
+    participants: Dict[int, List[int]] = {}
+    rows = db.execute(
+        select(game_players.c.game_id, game_players.c.user_id)
+        .where(game_players.c.game_id.in_({game.game_id for game in games}))
+    )
+    for game_id, user_id in rows:
+        participants.setdefault(game_id, []).append(user_id)
+
+    user_ids = {user_id for players in participants.values() for user_id in players}
+    user_ids.update(game.winner_id for game in games if game.winner_id is not None)
+    ratings = dict(db.query(User.id, User.rating).filter(User.id.in_(user_ids)).all())
+    return games, participants, ratings
+
+def _compute_changes(games, participants, ratings) -> List[Tuple[int, int, int]]:
+    """Новые рейтинги по пачке игр: [(игрок, было, стало)]"""
+    user_ids = np.array(sorted(ratings), dtype=np.int64)
+    position = {user_id: index for index, user_id in enumerate(user_ids.tolist())}
+    base = np.array([ratings[user_id] or 1000 for user_id in user_ids.tolist()], dtype=float)
+
+    seats = []
+    for game in games:
+        players = [user_id for user_id in participants.get(game.game_id, []) if user_id in position]
+        if game.winner_id in position and game.winner_id not in players:
+            players.append(game.winner_id)
+        seats.append(players)
+
+    width = max((len(players) for players in seats), default=0)
+    if width < 2:
+        return []
+
+    # Матрица мест игры × игроки, -1 для пустых мест
+    index = np.full((len(games), width), -1, dtype=np.int64)
+    winners = np.zeros((len(games), width), dtype=bool)
+    for row, (game, players) in enumerate(zip(games, seats)):
+        index[row, :len(players)] = [position[user_id] for user_id in players]
+        if game.winner_id in players:
+            winners[row, players.index(game.winner_id)] = True
+
+    present = index >= 0
+    deltas = compute_rating_deltas(np.where(present, base[index], 0.0), present, winners)
+
+    totals = np.zeros(len(user_ids))
+    np.add.at(totals, index[present], deltas[present])
+    new_ratings = np.rint(base + totals).astype(np.int64)
+
+    changed = np.flatnonzero(new_ratings != base)
+    return [
+        (int(user_ids[i]), int(base[i]), int(new_ratings[i]))
+        for i in changed
+    ]
+
+def _rate_batch(limit: int, legacy_watermark: int = 0) -> Tuple[int, List[Tuple[int, int, int]]]:
+    """Пересчитать пачку игр после водяного знака; возвращает (число игр, [(игрок, было, стало)])"""
+    db = SessionLocal()
+    try:
+        # Блокировка строки не дает двум запускам учесть одну пачку дважды
+        watermark = (
+            db.query(RatingWatermark)
+            .filter(RatingWatermark.id == 1)
+            .with_for_update()
+            .first()
+        )
+        if watermark is None:
+            watermark = RatingWatermark(id=1, last_history_id=legacy_watermark)
+            db.add(watermark)
+            db.flush()
+
+        games, participants, ratings = _load_batch(db, watermark.last_history_id, limit)
+        if not games:
+            db.commit()
+            return 0, []
+
+        changes = _compute_changes(games, participants, ratings)
+        if changes:
+            new_values = values(
+                column("id", Integer),
+                column("rating", Integer),
+                name="new_ratings"
+            ).data([(user_id, rating) for user_id, _, rating in changes])
+            db.execute(
+                update(User)
+                .where(User.id == new_values.c.id)
+                .values(rating=new_values.c.rating)
+                .execution_options(synchronize_session=False)
+            )
+        watermark.last_history_id = games[-1].id
+        db.commit()
+        return len(games), changes
+    finally:
+        db.close()
+
+async def update_ratings(batch_size: int = RATING_BATCH_SIZE) -> int:
+    """Пересчитать рейтинги по всем играм после водяного знака; возвращает число игр"""
+    redis = await CacheManager.get_redis()
+    legacy_watermark = int(await redis.get(LEGACY_WATERMARK_KEY) or 0)
+    processed = 0
+    while True:
+        count, changes = await run_in_threadpool(_rate_batch, batch_size, legacy_watermark)
+        if not count:
+            return processed
+
+        # Кэши в Redis; при сбое их восстанавливает пересборка таблиц лидеров
+        async with redis.pipeline(transaction=False) as pipe:
+            for user_id, _, rating in changes:
+                pipe.hset(f"user:{user_id}:stats", "rating", rating)
+            if changes:
+                pipe.zadd(GLOBAL_LEADERBOARD_KEY, {user_id: rating for user_id, _, rating in changes})
+            await pipe.execute()
+
+        await asyncio.gather(*(
+            achievement_manager.unlock_achievement(str(user_id), AchievementType.HIGH_ROLLER)
+            for user_id, old, new in changes
+            if old < HIGH_ROLLER_RATING <= new
+        ))
+
+        processed += count
+        logger.info(f"Updated ratings of {len(changes)} players from {count} games")
+        if count < batch_size:
+            return processed
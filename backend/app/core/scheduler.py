@@ -0,0 +1,123 @@
+from functools import wraps
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+from prometheus_client import Gauge, Histogram
+import asyncio
+import random
+import time
+from .cache import CacheManager
+from .logging import logger
+
+JOB_DURATION = Histogram(
+    "scheduler_job_duration_seconds",
+    "Duration of singleton background job runs",
+    ["job"]
+)
+JOB_LAST_SUCCESS = Gauge(
+    "scheduler_job_last_success_timestamp",
+    "Unix time of the last successful background job run",
+    ["job"]
+)
+
+# KEYS: running lock
+# ARGV: token of the run holding the lock
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+WORKER_ID = uuid4().hex
+
+# Upper bound on the start delay, so long intervals don't turn jitter into hours
+MAX_JITTER_SECONDS = 5.0
+
+_release_script = None
+
+def _keys(name: str) -> dict:
+    prefix = f"scheduler:{name}"
+    return {
+        "lease": f"{prefix}:lease",
+        "running": f"{prefix}:running",
+        "metrics": f"{prefix}:metrics"
+    }
+
+async def _release(redis, key: str, token: str):
+    global _release_script
+    if _release_script is None:
+        _release_script = redis.register_script(RELEASE_LOCK_SCRIPT)
+    await _release_script(keys=[key], args=[token])
+
+def singleton_job(
+    name: str,
+    interval: float,
+    jitter: float = 0.1,
+    max_runtime: Optional[float] = None
+) -> Callable[[Callable[[], Awaitable[None]]], Callable[[], Awaitable[None]]]:
+    """Run a periodic job at most once per interval across all workers.
+
+    Meant to sit under ``repeat_every``: every worker ticks, the first one to
+    take the lease for the interval runs the job and the others skip it.
+    A separate running lock keeps a slow run from overlapping the next one.
+    Exceptions must propagate out of the job so failed runs are counted.
+    """
+    max_runtime = max_runtime or interval * 5
+
+    def decorator(func: Callable[[], Awaitable[None]]) -> Callable[[], Awaitable[None]]:
+        keys = _keys(name)
+
+        delay = min(interval * jitter, MAX_JITTER_SECONDS)
+
+        @wraps(func)
+        async def wrapped() -> None:
+            # Spread the workers' ticks so they don't all race for the lease at once
+            if delay:
+                await asyncio.sleep(random.uniform(0, delay))
+
+            try:
+                redis = await CacheManager.get_redis()
+                if not await redis.set(keys["lease"], WORKER_ID, nx=True, px=int(interval * 1000)):
+                    return
+
+                token = uuid4().hex
+                if not await redis.set(keys["running"], token, nx=True, px=int(max_runtime * 1000)):
+                    logger.warning(f"Skipping job {name}: previous run still in progress")
+                    return
+            except Exception as e:
+                logger.error(f"Error acquiring lease for job {name}: {str(e)}")
+                return
+
+            started = time.time()
+            succeeded = False
+            try:
+                await func()
+                succeeded = True
+            except Exception as e:
+                logger.error(f"Error in job {name}: {str(e)}")
+            finally:
+                duration = time.time() - started
+                JOB_DURATION.labels(job=name).observe(duration)
+                metrics = {
+                    "last_run": started,
+                    "last_duration": duration,
+                    "worker": WORKER_ID
+                }
+                if succeeded:
+                    metrics["last_success"] = started + duration
+                    JOB_LAST_SUCCESS.labels(job=name).set(started + duration)
+
+                try:
+                    async with redis.pipeline(transaction=False) as pipe:
+                        pipe.hset(keys["metrics"], mapping=metrics)
+                        pipe.hincrby(keys["metrics"], "runs", 1)
+                        if not succeeded:
+                            pipe.hincrby(keys["metrics"], "failures", 1)
+                        await pipe.execute()
+                    await _release(redis, keys["running"], token)
+                except Exception as e:
+                    logger.error(f"Error recording run of job {name}: {str(e)}")
+
+        return wrapped
+
+    return decorator
\ No newline at end of file
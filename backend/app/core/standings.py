@@ -0,0 +1,63 @@
+from typing import List, Optional, Tuple
+from .cache import CacheManager
+from .logging import logger
+
+class StandingsManager:
+    """Per-game standings kept as a sorted set of marked counts.
+
+    Every mark is a ZINCRBY, so leader and deficit lookups are O(log n)
+    instead of scanning every player's marked numbers.
+    """
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(game_id) -> str:
+        return f"game:{game_id}:standings"
+
+    async def record_mark(self, game_id, player_id) -> Tuple[int, int]:
+        """Count a newly marked number and return (player marks, leader marks)"""
+        redis = await CacheManager.get_redis()
+        key = self._key(game_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zincrby(key, 1, str(player_id))
+            pipe.zrevrange(key, 0, 0, withscores=True)
+            pipe.expire(key, self.ttl)
+            marked, leader, _ = await pipe.execute()
+        return int(marked), int(leader[0][1]) if leader else int(marked)
+
+    async def get_leader(self, game_id) -> Optional[Tuple[str, int]]:
+        """Get the player with the most marked numbers"""
+        top = await self.get_top(game_id, 1)
+        return top[0] if top else None
+
+    async def get_deficit(self, game_id, player_id) -> int:
+        """Get how many marks a player is behind the leader"""
+        redis = await CacheManager.get_redis()
+        key = self._key(game_id)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zscore(key, str(player_id))
+            pipe.zrevrange(key, 0, 0, withscores=True)
+            marked, leader = await pipe.execute()
+        if not leader:
+            return 0
+        return int(leader[0][1]) - int(marked or 0)
+
+    async def get_top(self, game_id, limit: int = 5) -> List[Tuple[str, int]]:
+        """Get players closest to bingo, best first"""
+        try:
+            redis = await CacheManager.get_redis()
+            top = await redis.zrevrange(self._key(game_id), 0, limit - 1, withscores=True)
+            return [(player_id, int(score)) for player_id, score in top]
+        except Exception as e:
+            logger.error(f"Error getting standings: {str(e)}")
+            return []
+
+    async def clear(self, game_id):
+        """Drop standings of a finished game"""
+        redis = await CacheManager.get_redis()
+        await redis.delete(self._key(game_id))
+
+# Create global standings manager instance
+standings_manager = StandingsManager()
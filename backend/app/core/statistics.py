@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+import os
+from .cache import CacheManager
+from .events import GameEvent, GameEventType, event_manager
+from .logging import logger
+
+# Hourly buckets are kept for this many hours
+STATS_RETENTION_HOURS = int(os.getenv("STATS_RETENTION_HOURS", str(24 * 8)))
+
+class StatisticsManager:
+    """Game statistics kept incrementally in hourly Redis buckets.
+
+    Each bucket is a hash of counters (games, duration_sum, duration_count)
+    plus a HyperLogLog of the players seen during that hour, so queries
+    read one bucket per hour instead of scanning games.
+    """
+
+    def __init__(self):
+        event_manager.subscribe(GameEventType.GAME_FINISHED, self._on_game_finished)
+        event_manager.subscribe(GameEventType.NUMBER_MARKED, self._on_player_activity)
+
+    @staticmethod
+    def _bucket(moment: datetime) -> str:
+        return moment.strftime("%Y%m%d%H")
+
+    @staticmethod
+    def _keys(bucket: str) -> Dict[str, str]:
+        return {
+            "counters": f"stats:hour:{bucket}",
+            "players": f"stats:hour:{bucket}:players"
+        }
+
+    async def _on_game_finished(self, event: GameEvent):
+        try:
+            keys = self._keys(self._bucket(event.timestamp))
+            duration = event.data.get("duration")
+            players = [str(player) for player in event.data.get("players") or []]
+
+            redis = await CacheManager.get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hincrby(keys["counters"], "games", 1)
+                if duration is not None:
+                    pipe.hincrby(keys["counters"], "duration_sum", int(duration))
+                    pipe.hincrby(keys["counters"], "duration_count", 1)
+                if players:
+                    pipe.pfadd(keys["players"], *players)
+                    pipe.expire(keys["players"], STATS_RETENTION_HOURS * 3600)
+                pipe.expire(keys["counters"], STATS_RETENTION_HOURS * 3600)
+                await pipe.execute()
+
+        except Exception as e:
+            logger.error(f"Error recording game statistics: {str(e)}")
+
+    async def _on_player_activity(self, event: GameEvent):
+        if not event.player_id:
+            return
+        try:
+            players_key = self._keys(self._bucket(event.timestamp))["players"]
+            redis = await CacheManager.get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.pfadd(players_key, event.player_id)
+                pipe.expire(players_key, STATS_RETENTION_HOURS * 3600)
+                await pipe.execute()
+
+        except Exception as e:
+            logger.error(f"Error recording player activity: {str(e)}")
+
+    async def get_statistics(self, hours: int = 24) -> Dict[str, Any]:
+        """Aggregate the last `hours` buckets"""
+        hours = max(1, min(hours, STATS_RETENTION_HOURS))
+        now = datetime.now()
+        buckets = [self._bucket(now - timedelta(hours=offset)) for offset in range(hours)]
+
+        redis = await CacheManager.get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            for bucket in buckets:
+                pipe.hgetall(self._keys(bucket)["counters"])
+            # PFCOUNT over several keys counts the union of the hours
+            pipe.pfcount(*(self._keys(bucket)["players"] for bucket in buckets))
+            results = await pipe.execute()
+
+        counters: List[Dict[str, str]] = results[:-1]
+        games_by_hour: Dict[int, int] = {}
+        total_games = duration_sum = duration_count = 0
+        for bucket, values in zip(buckets, counters):
+            games = int(values.get("games", 0))
+            total_games += games
+            duration_sum += int(values.get("duration_sum", 0))
+            duration_count += int(values.get("duration_count", 0))
+            if games:
+                hour = int(bucket[-2:])
+                games_by_hour[hour] = games_by_hour.get(hour, 0) + games
+
+        return {
+            "total_games": total_games,
+            "active_players": results[-1],
+            "average_game_duration": duration_sum / duration_count if duration_count else 0.0,
+            "most_active_hours": sorted(games_by_hour, key=games_by_hour.get, reverse=True)[:3]
+        }
+
+# Create global statistics manager instance
+statistics_manager = StatisticsManager()
@@ -1,100 +1,143 @@
 from fastapi_utils.tasks import repeat_every
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
-from typing import List
+from typing import Dict, List, Tuple
+import json
+import time
 from .logging import logger
 from .cache import CacheManager
+from .chat_archive import chat_archiver
+from .database import SessionLocal
+from .events import event_manager, GameEvent, GameEventType
+from .notifications import notification_manager
+from .ratings import update_ratings
+from .scheduler import singleton_job
+from ..services.game_service import VICTORY_CLAIM_WINDOW, GameService
+from ..services.leaderboard_service import LeaderboardService
+from ..services.redis_service import (
+    GAMES_ACTIVITY_KEY,
+    LOBBY_CHANNEL,
+    LOBBY_GAMES_KEY,
+    LOBBY_SUMMARIES_KEY,
+    RedisService,
+    game_key_footprint
+)
+
+# A claimant's worker settles its game right after the claim window;
+# only games still unfinished this much later are taken over
+SETTLEMENT_GRACE_SECONDS = 30
 
 class BackgroundTasks:
     @staticmethod
     @repeat_every(seconds=60)
+    @singleton_job("cleanup_inactive_games", interval=60)
     async def cleanup_inactive_games():
         """Cleanup inactive games every minute"""
-        try:
-            redis = await CacheManager.get_redis()
-            
-            # Get all active games
-            active_games = await redis.smembers("active_games")
-            
-            for game_id in active_games:
-                # Check last activity
-                last_activity = await redis.get(f"game:{game_id}:last_activity")
-                if last_activity:
-                    last_activity_time = datetime.fromisoformat(last_activity)
-                    
-                    # If inactive for more than 30 minutes
-                    if datetime.now() - last_activity_time > timedelta(minutes=30):
-                        await redis.srem("active_games", game_id)
-                        logger.info(f"Cleaned up inactive game {game_id}")
-                        
-        except Exception as e:
-            logger.error(f"Error in cleanup_inactive_games: {str(e)}")
+        redis = await CacheManager.get_redis()
+        
+        # Games inactive for more than 30 minutes
+        cutoff = (datetime.now() - timedelta(minutes=30)).timestamp()
+        stale_games = await redis.zrangebyscore(GAMES_ACTIVITY_KEY, "-inf", cutoff)
+        if not stale_games:
+            return
+        
+        async with redis.pipeline(transaction=False) as pipe:
+            for game_id in stale_games:
+                pipe.sismember("chat:games", game_id)
+            has_chats = await pipe.execute()
+        
+        async with redis.pipeline(transaction=False) as pipe:
+            for game_id, has_chat in zip(stale_games, has_chats):
+                pipe.delete(*game_key_footprint(game_id))
+                # Chat history is archived to Postgres before its keys are dropped
+                if has_chat:
+                    pipe.sadd("chat:closed_games", game_id)
+            pipe.zrem(GAMES_ACTIVITY_KEY, *stale_games)
+            pipe.zrem(LOBBY_GAMES_KEY, *stale_games)
+            pipe.hdel(LOBBY_SUMMARIES_KEY, *stale_games)
+            for game_id in stale_games:
+                pipe.publish(LOBBY_CHANNEL, json.dumps({"type": "lobby_remove", "game_id": int(game_id)}))
+            await pipe.execute()
+        
+        logger.info(f"Cleaned up {len(stale_games)} inactive games")
 
     @staticmethod
     @repeat_every(seconds=300)
+    @singleton_job("update_player_ratings", interval=300)
     async def update_player_ratings():
-        """Update player ratings every 5 minutes"""
-        try:
-            redis = await CacheManager.get_redis()
-            
-            # Get all players that need rating update
-            players_to_update = await redis.smembers("players_rating_update")
-            
-            for player_id in players_to_update:
-                # Calculate new rating based on recent games
-                new_rating = await calculate_player_rating(player_id)
-                
-                # Update rating in database
-                await update_player_rating_in_db(player_id, new_rating)
-                
-                # Remove from update set
-                await redis.srem("players_rating_update", player_id)
-                
-        except Exception as e:
-            logger.error(f"Error in update_player_ratings: {str(e)}")
+        """Update player ratings from games finished since the last run every 5 minutes"""
+        await update_ratings()
 
     @staticmethod
-    @repeat_every(seconds=3600)
-    async def generate_daily_statistics():
-        """Generate daily statistics every hour"""
-        try:
-            # Calculate various statistics
-            stats = {
-                "total_games": await get_total_games_today(),
-                "active_players": await get_active_players_count(),
-                "average_game_duration": await calculate_average_game_duration(),
-                "most_active_hours": await get_most_active_hours()
-            }
-            
-            # Store statistics in Redis
-            redis = await CacheManager.get_redis()
-            # Convert all values to strings for Redis storage
-            stats_str = {k: str(v) for k, v in stats.items()}
-            await redis.hmset("daily_statistics", stats_str)
-            
-        except Exception as e:
-            logger.error(f"Error in generate_daily_statistics: {str(e)}")
+    @repeat_every(seconds=60)
+    @singleton_job("archive_chat_history", interval=60)
+    async def archive_chat_history():
+        """Move chat history beyond the hot window to Postgres every minute"""
+        await chat_archiver.archive_all()
 
-# Helper functions with default implementations
-async def calculate_player_rating(player_id: str) -> int:
-    # Default implementation returns base rating
-    return 1000
+    @staticmethod
+    @repeat_every(seconds=24 * 3600)
+    @singleton_job("rebuild_leaderboards", interval=24 * 3600)
+    async def rebuild_leaderboards():
+        """Reseed leaderboards from Postgres once a day"""
+        await run_in_threadpool(_rebuild_leaderboards)
 
-async def update_player_rating_in_db(player_id: str, rating: int):
-    # TODO: Implement database update
-    pass
+    @staticmethod
+    @repeat_every(seconds=30)
+    @singleton_job("finish_settled_games", interval=30)
+    async def finish_settled_games():
+        """Settle and finish games whose victory claims were left half-done"""
+        finished = await run_in_threadpool(_finish_settled_games)
+        for game_id, result in finished:
+            await event_manager.publish_event(GameEvent(
+                event_type=GameEventType.GAME_FINISHED,
+                game_id=str(game_id),
+                player_id=str(result["winner_id"]),
+                data=result
+            ))
+        if finished:
+            logger.info(f"Finished {len(finished)} games with interrupted settlement")
 
-async def get_total_games_today() -> int:
-    # Default implementation returns 0
-    return 0
+    @staticmethod
+    @repeat_every(seconds=5)
+    async def flush_notification_digests():
+        """Deliver notification digests whose window has closed.
+
+        Runs on every worker: due users are claimed atomically, so
+        concurrent flushes never deliver the same digest twice.
+        """
+        try:
+            await notification_manager.flush_digests()
+        except Exception as e:
+            logger.error(f"Error in flush_notification_digests: {str(e)}")
 
-async def get_active_players_count() -> int:
-    # Default implementation returns 0
-    return 0
+def _rebuild_leaderboards():
+    db = SessionLocal()
+    try:
+        LeaderboardService(RedisService()).rebuild(db)
+    finally:
+        db.close()
 
-async def calculate_average_game_duration() -> float:
-    # Default implementation returns 0.0
-    return 0.0
+def _finish_settled_games() -> List[Tuple[int, Dict]]:
+    redis_service = RedisService()
+    cutoff = time.time() - VICTORY_CLAIM_WINDOW - SETTLEMENT_GRACE_SECONDS
+    game_ids = redis_service.get_stalled_settlements(cutoff)
+    if not game_ids:
+        return []
 
-async def get_most_active_hours() -> List[int]:
-    # Default implementation returns empty list
-    return [] 
\ No newline at end of file
+    db = SessionLocal()
+    try:
+        game_service = GameService(db, redis_service)
+        finished = []
+        for game_id in game_ids:
+            winner_id, _ = game_service.settle_victory(game_id)
+            if winner_id is None:
+                # No claim left to settle: the game's keys are already gone
+                redis_service.complete_settlement(game_id)
+                continue
+            result = game_service.finish_game(game_id, winner_id)
+            if result:
+                finished.append((game_id, result))
+        return finished
+    finally:
+        db.close()
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+from starlette.concurrency import run_in_threadpool
+import os
+import time
+from .cache import CacheManager
+from .database import SessionLocal
+from .logging import logger
+from ..models.models import User
+
+# How long a name missing from Postgres is answered from memory (seconds)
+UNKNOWN_USERNAME_TTL = float(os.getenv("UNKNOWN_USERNAME_TTL", "30"))
+
+class UserDirectory:
+    """Username -> user id index.
+
+    Lookups go through an in-process LRU, then the Redis hash
+    `users:by_username`, and finally Postgres for names not indexed yet,
+    which are written back to the hash. A whole batch of names costs at
+    most one Redis call and one query. Names Postgres does not know are
+    remembered for UNKNOWN_USERNAME_TTL seconds, so repeated mentions of
+    them don't reach the database.
+    """
+
+    INDEX_KEY = "users:by_username"
+
+    def __init__(self, cache_size: int = 10000):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._unknown: "OrderedDict[str, float]" = OrderedDict()  # username -> expiry
+
+    def _remember(self, username: str, user_id: str):
+        self._cache[username] = user_id
+        self._cache.move_to_end(username)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _remember_unknown(self, username: str):
+        self._unknown[username] = time.monotonic() + UNKNOWN_USERNAME_TTL
+        self._unknown.move_to_end(username)
+        if len(self._unknown) > self.cache_size:
+            self._unknown.popitem(last=False)
+
+    def _is_unknown(self, username: str) -> bool:
+        expires = self._unknown.get(username)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._unknown[username]
+            return False
+        return True
+
+    async def register(self, username: str, user_id):
+        """Add a user to the index"""
+        try:
+            redis = await CacheManager.get_redis()
+            await redis.hset(self.INDEX_KEY, username, str(user_id))
+            self._unknown.pop(username, None)
+            self._remember(username, str(user_id))
+        except Exception as e:
+            logger.error(f"Error indexing username: {str(e)}")
+
+    async def resolve(self, usernames: Iterable[str]) -> Dict[str, str]:
+        """Resolve usernames to user ids; unknown names are omitted"""
+        result: Dict[str, str] = {}
+        misses: List[str] = []
+        for username in set(usernames):
+            user_id = self._cache.get(username)
+            if user_id is None:
+                if not self._is_unknown(username):
+                    misses.append(username)
+            else:
+                self._cache.move_to_end(username)
+                result[username] = user_id
+        if not misses:
+            return result
+
+        redis = await CacheManager.get_redis()
+        for username, user_id in zip(misses, await redis.hmget(self.INDEX_KEY, misses)):
+            if user_id is not None:
+                result[username] = user_id
+                self._remember(username, user_id)
+
+        unindexed = [username for username in misses if username not in result]
+        if unindexed:
+            found = await run_in_threadpool(self._query_ids, unindexed)
+            if found:
+                await redis.hset(self.INDEX_KEY, mapping=found)
+                for username, user_id in found.items():
+                    result[username] = user_id
+                    self._remember(username, user_id)
+            for username in unindexed:
+                if username not in found:
+                    self._remember_unknown(username)
+
+        return result
+
+    def _query_ids(self, usernames: List[str]) -> Dict[str, str]:
+        db = SessionLocal()
+        try:
+            rows = db.query(User.username, User.id).filter(User.username.in_(usernames)).all()
+            return {username: str(user_id) for username, user_id in rows}
+        finally:
+            db.close()
+
+# Create global user directory instance
+user_directory = UserDirectory()
@@ -9,8 +9,13 @@ from .core.tasks import BackgroundTasks
 from .core.events import event_manager
 from .core.chat import chat_manager
 from .core.notifications import notification_manager
-from .core.achievements import AchievementManager
-from .routes import auth, game, websockets, achievements
+from .core.presence import presence_manager
+from .core.mailer import email_queue
+from .core.matchmaking import matchmaking_queue
+from .core.lobby import lobby_relay
+from .core.achievements import achievement_manager
+from .core.statistics import statistics_manager
+from .routes import auth, game, websockets, achievements, leaderboard
 from .core.database import engine
 from .models.models import Base
 import uvicorn
@@ -19,9 +24,6 @@ import os
 # Создаем таблицы в базе данных
 Base.metadata.create_all(bind=engine)
 
-# Инициализация менеджера достижений
-achievement_manager = AchievementManager()
-
 app = FastAPI(
     title="Bingo Game API",
     description="""
@@ -71,6 +73,7 @@ app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(game.router, prefix="/game", tags=["game"])
 app.include_router(websockets.router, prefix="/ws", tags=["websockets"])
 app.include_router(achievements.router, prefix="/achievements", tags=["achievements"])
+app.include_router(leaderboard.router, prefix="/leaderboard", tags=["leaderboard"])
 
 # Startup events
 @app.on_event("startup")
@@ -85,14 +88,34 @@ async def startup_event():
     LogConfig.setup_logging()
     LogConfig.setup_sentry()
     
+    # Start receiving pushes for sockets held by this worker
+    await presence_manager.start()
+    
+    # Start outbound email delivery
+    await email_queue.start()
+    await matchmaking_queue.start()
+    await lobby_relay.start()
+    
     # Start background tasks
     await BackgroundTasks.cleanup_inactive_games()
     await BackgroundTasks.update_player_ratings()
-    await BackgroundTasks.generate_daily_statistics()
+    await BackgroundTasks.archive_chat_history()
+    await BackgroundTasks.rebuild_leaderboards()
+    await BackgroundTasks.finish_settled_games()
+    await BackgroundTasks.flush_notification_digests()
 
 # Shutdown events
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Stop push delivery
+    await presence_manager.stop()
+    await email_queue.stop()
+    await matchmaking_queue.stop()
+    await lobby_relay.stop()
+    
+    # Persist buffered chat messages
+    await chat_manager.flush()
+    
     # Close Redis connections
     await CacheManager.close()
 
@@ -165,6 +188,10 @@ def custom_openapi():
             - Дату получения
             - Награду в очках
             """
+        },
+        {
+            "name": "leaderboard",
+            "description": "Таблицы лидеров: общий рейтинг и победы за день и неделю"
         }
     ]
 
@@ -490,7 +517,7 @@ def custom_openapi():
             - `{"type": "message", "text": str}` - Сообщение в чат
             
             ## Исходящие сообщения:
-            - `{"type": "message", "player": str, "text": str}` - Сообщение от игрока
+            - `{"type": "message", "player": str, "text": str, "message_id": str, "moderated": bool}` - Сообщение от игрока
             - `{"type": "system", "text": str}` - Системное сообщение
             """,
             "parameters": [
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, JSON, Table
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, BigInteger, String, Text, DateTime, JSON, Table, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .base import Base
@@ -54,4 +54,31 @@ class GameHistory(Base):
     winner_id = Column(Integer, ForeignKey("users.id"))
     duration = Column(Integer)  # в секундах
     players_count = Column(Integer)
-    created_at = Column(DateTime, default=datetime.utcnow) 
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class RatingWatermark(Base):
+    __tablename__ = "rating_watermark"
+
+    # Единственная строка: последний game_history.id, учтенный в рейтинге
+    id = Column(Integer, primary_key=True)
+    last_history_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ChatMessageArchive(Base):
+    __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Курсор истории чата: id записи Redis stream в виде (ms, seq)
+        UniqueConstraint("game_id", "stream_ms", "stream_seq", name="uq_chat_messages_cursor"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    game_id = Column(String, index=True)
+    stream_ms = Column(BigInteger)
+    stream_seq = Column(Integer)
+    message_id = Column(String)
+    player_id = Column(String)
+    content = Column(Text)
+    type = Column(String)
+    mentions = Column(JSON, default=list)
+    reactions = Column(JSON, default=dict)  # emoji -> [player_ids] на момент архивации
+    created_at = Column(DateTime)
@@ -46,12 +46,7 @@ async def get_achievement_points(current_user: User = Depends(get_current_user))
     Returns:
         int: Количество очков достижений
     """
-    achievements = await achievement_manager.get_user_achievements(str(current_user.id))
-    return sum(
-        achievement.points
-        for achievement in achievements
-        if achievement.unlocked_at is not None
-    )
+    return await achievement_manager.get_achievement_points(str(current_user.id))
 
 @router.get("/unlocked", response_model=List[Achievement])
 async def get_unlocked_achievements(current_user: User = Depends(get_current_user)):
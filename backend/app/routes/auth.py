@@ -8,6 +8,7 @@ from typing import Optional
 from ..models.models import User
 from ..schemas import UserCreate, Token, User as UserSchema
 from ..core.database import get_db
+from ..core.users import user_directory
 import os
 
 router = APIRouter()
@@ -117,6 +118,7 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    await user_directory.register(db_user.username, db_user.id)
     
     access_token = create_access_token({"sub": user.email})
     refresh_token = create_refresh_token({"sub": user.email})
@@ -1,23 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status, WebSocket
 from sqlalchemy.orm import Session
-from typing import List
-from ..models.models import User
-from ..schemas import GameCreate, GameState, GameAction, GameHistoryResponse
+from typing import List, Optional
+from ..models.models import Game, GameHistory, User
+from ..schemas import GameCreate, GameState, GameAction, GameHistoryResponse, LobbyPage
 from ..services.game_service import GameService
+from ..services.lobby_service import LobbyService
 from ..services.redis_service import RedisService
 from ..websockets.game_ws import GameWebSocket
-from ..core.database import get_db
+from ..core.database import SessionLocal, get_db
+from ..core.matchmaking import matchmaking_queue
+from ..core.statistics import statistics_manager
 from .auth import get_current_user
 
 router = APIRouter()
 
 # Инициализация сервисов
 redis_service = RedisService()
+lobby_service = LobbyService(redis_service)
 game_websocket = None
 
 def get_game_service(db: Session = Depends(get_db)) -> GameService:
     return GameService(db, redis_service)
 
+def record_join(game_id: int, player_id: int):
+    """Фоновая запись присоединения в Postgres со своей сессией"""
+    db = SessionLocal()
+    try:
+        GameService(db, redis_service).record_join(game_id, player_id)
+    finally:
+        db.close()
+
 @router.post("/games", response_model=GameState)
 async def create_game(
     game_data: GameCreate,
@@ -28,18 +40,52 @@ async def create_game(
     game = game_service.create_game(current_user, game_data.max_players)
     return GameState.from_orm(game)
 
-@router.get("/games/active", response_model=List[GameState])
+@router.post("/matchmaking")
+async def enter_matchmaking(current_user: User = Depends(get_current_user)):
+    """Встать в очередь подбора игры; найденную игру возвращает GET /matchmaking"""
+    await matchmaking_queue.enqueue(current_user.id, current_user.rating)
+    return {"message": "Queued for matchmaking"}
+
+@router.get("/matchmaking")
+async def get_matchmaking_status(current_user: User = Depends(get_current_user)):
+    """Состояние подбора: игра, в которую попал игрок, или ожидание в очереди.
+
+    Полная игра уже начата; неполную начинает ее создатель, первый игрок группы.
+    """
+    result = await matchmaking_queue.get_status(current_user.id)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not in matchmaking queue"
+        )
+    return result
+
+@router.delete("/matchmaking")
+async def leave_matchmaking(current_user: User = Depends(get_current_user)):
+    """Выйти из очереди подбора игры"""
+    if not await matchmaking_queue.dequeue(current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not in matchmaking queue"
+        )
+    return {"message": "Left matchmaking queue"}
+
+@router.get("/games/active", response_model=LobbyPage)
 async def list_active_games(
-    db: Session = Depends(get_db),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    min_free_seats: int = Query(1, ge=1),
+    max_free_seats: Optional[int] = Query(None, ge=1),
     current_user: User = Depends(get_current_user)
 ):
-    """Получение списка активных игр"""
-    games = db.query(Game).filter(Game.status == "waiting").all()
-    return [GameState.from_orm(game) for game in games]
+    """Получение списка игр, к которым можно присоединиться, из индекса лобби"""
+    games, total = lobby_service.list_games(offset, limit, min_free_seats, max_free_seats)
+    return LobbyPage(games=games, total=total)
 
 @router.post("/games/{game_id}/join")
 async def join_game(
     game_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     game_service: GameService = Depends(get_game_service)
 ):
@@ -50,6 +96,7 @@ async def join_game(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=error
         )
+    background_tasks.add_task(record_join, game_id, current_user.id)
     return {"message": "Successfully joined the game"}
 
 @router.post("/games/{game_id}/start")
@@ -93,6 +140,14 @@ async def get_game_history(
     ).order_by(GameHistory.created_at.desc()).all()
     return [GameHistoryResponse.from_orm(h) for h in history]
 
+@router.get("/statistics")
+async def get_statistics(
+    hours: int = Query(24, ge=1, le=24 * 7),
+    current_user: User = Depends(get_current_user)
+):
+    """Статистика игр за последние часы"""
+    return await statistics_manager.get_statistics(hours)
+
 @router.websocket("/ws/game/{game_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Dict, List
+from ..core.auth import get_current_user
+from ..core.database import get_db
+from ..models.models import User
+from ..schemas import LeaderboardEntry
+from ..services.leaderboard_service import LeaderboardPeriod, LeaderboardService
+from ..services.redis_service import RedisService
+
+router = APIRouter()
+
+leaderboard_service = LeaderboardService(RedisService())
+
+def _with_usernames(db: Session, entries: List[Dict]) -> List[LeaderboardEntry]:
+    """Подставить имена игроков одним запросом"""
+    user_ids = [entry["user_id"] for entry in entries]
+    usernames = dict(db.query(User.id, User.username).filter(User.id.in_(user_ids)).all()) if user_ids else {}
+    return [LeaderboardEntry(username=usernames.get(entry["user_id"]), **entry) for entry in entries]
+
+@router.get("/{period}", response_model=List[LeaderboardEntry])
+async def get_top(
+    period: LeaderboardPeriod,
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Лучшие игроки таблицы"""
+    return _with_usernames(db, leaderboard_service.get_top(period, limit, offset))
+
+@router.get("/{period}/me", response_model=LeaderboardEntry)
+async def get_my_rank(
+    period: LeaderboardPeriod,
+    current_user: User = Depends(get_current_user)
+):
+    """Место текущего игрока"""
+    entry = leaderboard_service.get_rank(period, current_user.id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Player is not ranked")
+    return LeaderboardEntry(username=current_user.username, **entry)
+
+@router.get("/{period}/around", response_model=List[LeaderboardEntry])
+async def get_around_me(
+    period: LeaderboardPeriod,
+    radius: int = Query(5, ge=1, le=50),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Игроки рядом с текущим игроком"""
+    return _with_usernames(db, leaderboard_service.get_around(period, current_user.id, radius))
\ No newline at end of file
@@ -4,10 +4,19 @@ from ..core.database import get_db
 from ..models.models import User, Game
 from sqlalchemy.orm import Session
 from ..routes.auth import get_current_user
+from ..core.chat import chat_manager, ChatMessage
+from ..core.presence import presence_manager
+from ..core.lobby import lobby_relay
+from ..services.lobby_service import LobbyService
+from ..services.redis_service import RedisService
+from uuid import uuid4
 import json
 
 router = APIRouter()
 
+lobby_service = LobbyService(RedisService())
+LOBBY_SNAPSHOT_SIZE = 50
+
 # Хранилище активных соединений
 class ConnectionManager:
     def __init__(self):
@@ -21,22 +30,28 @@ class ConnectionManager:
         if game_id not in self.game_connections:
             self.game_connections[game_id] = {}
         self.game_connections[game_id][user_id] = websocket
+        await presence_manager.register(user_id, websocket)
 
     async def connect_to_chat(self, game_id: int, user_id: int, websocket: WebSocket):
         await websocket.accept()
         if game_id not in self.chat_connections:
             self.chat_connections[game_id] = {}
         self.chat_connections[game_id][user_id] = websocket
+        await presence_manager.register(user_id, websocket)
 
     async def disconnect_from_game(self, game_id: int, user_id: int):
         if game_id in self.game_connections:
-            self.game_connections[game_id].pop(user_id, None)
+            websocket = self.game_connections[game_id].pop(user_id, None)
+            if websocket:
+                await presence_manager.unregister(user_id, websocket)
             if not self.game_connections[game_id]:
                 self.game_connections.pop(game_id)
 
     async def disconnect_from_chat(self, game_id: int, user_id: int):
         if game_id in self.chat_connections:
-            self.chat_connections[game_id].pop(user_id, None)
+            websocket = self.chat_connections[game_id].pop(user_id, None)
+            if websocket:
+                await presence_manager.unregister(user_id, websocket)
             if not self.chat_connections[game_id]:
                 self.chat_connections.pop(game_id)
 
@@ -128,7 +143,7 @@ async def chat_websocket(
         - {"type": "message", "text": str} - Сообщение в чат
         
         Исходящие сообщения:
-        - {"type": "message", "player": str, "text": str} - Сообщение от игрока
+        - {"type": "message", "player": str, "text": str, "message_id": str, "moderated": bool} - Сообщение от игрока
         - {"type": "system", "text": str} - Системное сообщение
     
     Raises:
@@ -151,11 +166,21 @@ async def chat_websocket(
             while True:
                 data = await websocket.receive_json()
                 if data["type"] == "message":
+                    message = await chat_manager.prepare_message(ChatMessage(
+                        message_id=str(uuid4()),
+                        game_id=str(game_id),
+                        player_id=str(user.id),
+                        content=data["text"]
+                    ))
+                    # Рассылаем сразу, сохранение и события идут пачками после
                     await manager.broadcast_chat_message(game_id, {
                         "type": "message",
                         "player": user.username,
-                        "text": data["text"]
+                        "text": message.content,
+                        "message_id": message.message_id,
+                        "moderated": message.type == "moderated"
                     })
+                    chat_manager.enqueue_message(message)
         except WebSocketDisconnect:
             await manager.disconnect_from_chat(game_id, user.id)
             await manager.broadcast_chat_message(game_id, {
@@ -163,4 +188,41 @@ async def chat_websocket(
                 "text": f"{user.username} покинул чат"
             })
     except Exception as e:
-        await websocket.close(code=4000, reason=str(e)) 
\ No newline at end of file
+        await websocket.close(code=4000, reason=str(e)) 
+
+@router.websocket("/lobby")
+async def lobby_websocket(
+    websocket: WebSocket,
+    token: str,
+    db: Session = Depends(get_db)
+):
+    """
+    WebSocket соединение для лобби.
+    
+    Args:
+        websocket: WebSocket соединение
+        token: JWT токен для аутентификации
+        db: Сессия базы данных
+    
+    Messages:
+        Исходящие сообщения:
+        - {"type": "lobby_snapshot", "games": [...], "total": int} - Первая страница лобби при подключении
+        - {"type": "lobby_update", "game": {...}} - Игра появилась в лобби или изменилось число игроков
+        - {"type": "lobby_remove", "game_id": int} - Игра началась, заполнилась или завершилась
+    
+    Raises:
+        WebSocketDisconnect: При разрыве соединения
+    """
+    try:
+        await get_current_user(token, db)
+        await lobby_relay.connect(websocket)
+        games, total = lobby_service.list_games(limit=LOBBY_SNAPSHOT_SIZE)
+        await websocket.send_json({"type": "lobby_snapshot", "games": games, "total": total})
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            lobby_relay.disconnect(websocket)
+    except Exception as e:
+        lobby_relay.disconnect(websocket)
+        await websocket.close(code=4000, reason=str(e))
@@ -71,4 +71,21 @@ class GameHistoryResponse(BaseModel):
     created_at: datetime
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    username: Optional[str] = None
+    score: int
+
+class LobbyGame(BaseModel):
+    id: int
+    creator_id: int
+    max_players: int
+    players_count: int
+    created_at: Optional[datetime]
+
+class LobbyPage(BaseModel):
+    games: List[LobbyGame]
+    total: int
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""Компактное бинарное представление карточки лото.
+
+Карточка 3x9 содержит по 5 чисел в строке, а столбец числа однозначно
+задается самим числом (1-10, 11-20, ..., 81-90). Поэтому хватает 15 байт
+чисел по строкам и 27-битной маски отметок: всего 19 байт на карточку.
+"""
+from typing import Dict, List
+
+ROWS = 3
+COLUMNS = 9
+NUMBERS_PER_ROW = 5
+CARD_SIZE = ROWS * NUMBERS_PER_ROW + 4
+
+def number_column(number: int) -> int:
+    """Столбец карточки для числа"""
+    return min((number - 1) // 10, COLUMNS - 1)
+
+def encode_card(card: Dict) -> bytes:
+    """Упаковать карточку {"numbers", "marked"} в 19 байт"""
+    numbers = bytearray()
+    mask = 0
+    for row in range(ROWS):
+        for col in range(COLUMNS):
+            number = card["numbers"][row][col]
+            if number:
+                numbers.append(number)
+            if card["marked"][row][col]:
+                mask |= 1 << (row * COLUMNS + col)
+    if len(numbers) != ROWS * NUMBERS_PER_ROW:
+        raise ValueError(f"Card must contain {ROWS * NUMBERS_PER_ROW} numbers")
+    return bytes(numbers) + mask.to_bytes(4, "big")
+
+def decode_card(data: bytes) -> Dict:
+    """Распаковать карточку из 19 байт"""
+    numbers: List[List[int]] = [[0] * COLUMNS for _ in range(ROWS)]
+    mask = int.from_bytes(data[-4:], "big")
+    for index, number in enumerate(data[:ROWS * NUMBERS_PER_ROW]):
+        numbers[index // NUMBERS_PER_ROW][number_column(number)] = number
+    return {
+        "numbers": numbers,
+        "marked": [
+            [bool(mask >> (row * COLUMNS + col) & 1) for col in range(COLUMNS)]
+            for row in range(ROWS)
+        ]
+    }
\ No newline at end of file
@@ -1,14 +1,36 @@
+import os
 import random
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
-from ..models.models import Game, User, GameHistory
-from .redis_service import RedisService
+from ..models.models import Game, User, GameHistory, game_players
+from .redis_service import (
+    JOIN_ALREADY_JOINED,
+    JOIN_FULL,
+    JOIN_NO_META,
+    JOIN_NOT_WAITING,
+    RedisService
+)
+from .leaderboard_service import LeaderboardService
+from .lobby_service import LobbyService
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+JOIN_ERRORS = {
+    JOIN_NO_META: "Game not found",
+    JOIN_NOT_WAITING: "Game already started",
+    JOIN_ALREADY_JOINED: "Already in game",
+    JOIN_FULL: "Game is full"
+}
+
+# Сколько секунд после заявки на победу принимаются встречные заявки
+VICTORY_CLAIM_WINDOW = float(os.getenv("VICTORY_CLAIM_WINDOW", "1.0"))
+
 class GameService:
     def __init__(self, db: Session, redis: RedisService):
         self.db = db
         self.redis = redis
+        self.leaderboard = LeaderboardService(redis)
+        self.lobby = LobbyService(redis)
 
     def generate_card(self) -> List[List[int]]:
         """Генерация карточки для игры в лото"""
@@ -22,7 +44,7 @@ class GameService:
             # Заполняем выбранные позиции числами
             for col in positions:
                 min_num = col * 10 + 1
-                max_num = min_num + 9 if col < 8 else 91
+                max_num = min_num + 9  # последний столбец: 81-90
                 number = random.randint(min_num, max_num)
                 
                 # Проверяем, что число не повторяется в карточке
@@ -52,35 +74,93 @@ class GameService:
             "called_numbers": [],
             "players": [creator.id]
         })
+        self.redis.set_game_meta(game.id, "waiting", max_players)
+        self.redis.touch_game(game.id)
+        self.lobby.upsert(self.lobby.build_summary(game, 0))
         
         return game
 
-    def join_game(self, game_id: int, player: User) -> Tuple[bool, Optional[str]]:
-        """Присоединение к игре"""
-        game = self.db.query(Game).filter(Game.id == game_id).first()
-        if not game:
-            return False, "Game not found"
+    def create_matched_game(self, player_ids: List[int], max_players: int) -> Game:
+        """Создание игры для группы игроков из очереди подбора.
+
+        Игра записывается в Postgres одной вставкой, а состояние, состав
+        и карточки всех игроков попадают в Redis одной транзакцией.
+        """
+        game = Game(
+            creator_id=player_ids[0],
+            status="waiting",
+            max_players=max_players,
+            called_numbers=[]
+        )
+        self.db.add(game)
+        self.db.commit()
         
-        if game.status != "waiting":
-            return False, "Game already started"
-            
-        current_players = self.redis.get_game_players(game_id)
-        if len(current_players) >= game.max_players:
-            return False, "Game is full"
-            
-        if player.id in current_players:
-            return False, "Already in game"
+        self.redis.init_matched_game(
+            game.id,
+            {
+                "status": "waiting",
+                "current_number": None,
+                "called_numbers": [],
+                "players": player_ids
+            },
+            {
+                player_id: {
+                    "numbers": self.generate_card(),
+                    "marked": [[False] * 9 for _ in range(3)]
+                }
+                for player_id in player_ids
+            },
+            max_players
+        )
+        # Неполная игра из очереди подбора остается открытой в лобби
+        self.lobby.upsert(self.lobby.build_summary(game, len(player_ids)))
         
-        # Генерируем карточку для игрока
-        card = self.generate_card()
-        self.redis.set_player_card(game_id, player.id, {
-            "numbers": card,
+        return game
+
+    def join_game(self, game_id: int, player: User) -> Tuple[bool, Optional[str]]:
+        """Присоединение к игре.
+
+        Проверка статуса, свободного места и повторного входа, выдача
+        карточки и публикация обновления лобби выполняются одним скриптом
+        Redis. Запись в
+        game_players делает record_join после ответа клиенту.
+        """
+        card = {
+            "numbers": self.generate_card(),
             "marked": [[False] * 9 for _ in range(3)]
-        })
-        
-        self.redis.add_player_to_game(game_id, player.id)
+        }
+        result = self.redis.join_game(game_id, player.id, card)
+        if result == JOIN_NO_META:
+            # Игра создана до появления метаданных: восстанавливаем их из Postgres
+            game = self.db.query(Game).filter(Game.id == game_id).first()
+            if not game:
+                return False, "Game not found"
+            self.redis.set_game_meta(game_id, game.status, game.max_players, only_missing=True)
+            result = self.redis.join_game(game_id, player.id, card)
+
+        if result < 0:
+            return False, JOIN_ERRORS.get(result, "Game not found")
         return True, None
 
+    def record_join(self, game_id: int, player_id: int) -> None:
+        """Записать игрока и его карточку в game_players"""
+        card = self.redis.get_player_card(game_id, player_id)
+        exists = self.db.execute(
+            select(game_players.c.user_id).where(
+                game_players.c.game_id == game_id,
+                game_players.c.user_id == player_id
+            )
+        ).first()
+        if exists:
+            return
+        self.db.execute(game_players.insert().values(
+            game_id=game_id,
+            user_id=player_id,
+            card=card,
+            status="active"
+        ))
+        self.db.commit()
+
     def start_game(self, game_id: int) -> Tuple[bool, Optional[str]]:
         """Начало игры"""
         game = self.db.query(Game).filter(Game.id == game_id).first()
@@ -90,9 +170,11 @@ class GameService:
         if game.status != "waiting":
             return False, "Game already started"
             
-        players = self.redis.get_game_players(game_id)
-        if len(players) < 2:
+        if len(self.redis.get_game_players(game_id)) < 2:
             return False, "Not enough players"
+        
+        # Игроков не становится меньше, поэтому после закрытия набора их по-прежнему не меньше двух
+        players = self.redis.start_game_players(game_id)
             
         game.status = "active"
         game.started_at = datetime.utcnow()
@@ -105,13 +187,22 @@ class GameService:
             "players": players
         }
         self.redis.set_game_state(game_id, game_state)
+        self.redis.touch_game(game_id)
+        self.lobby.remove(game_id)
         
         return True, None
 
+    def _game_status(self, game_id: int) -> Optional[str]:
+        """Статус игры из метаданных Redis; Postgres читается только для игр без них"""
+        status = self.redis.get_game_status(game_id)
+        if status is None:
+            game = self.db.query(Game).filter(Game.id == game_id).first()
+            status = game.status if game else None
+        return status
+
     def draw_number(self, game_id: int) -> Tuple[Optional[int], Optional[str]]:
         """Вытягивание следующего номера"""
-        game = self.db.query(Game).filter(Game.id == game_id).first()
-        if not game or game.status != "active":
+        if self._game_status(game_id) != "active":
             return None, "Game not active"
             
         called_numbers = self.redis.get_called_numbers(game_id)
@@ -127,35 +218,112 @@ class GameService:
         game_state["current_number"] = number
         game_state["called_numbers"] = called_numbers + [number]
         self.redis.set_game_state(game_id, game_state)
+        self.redis.touch_game(game_id)
         
         return number, None
 
-    def check_victory(self, game_id: int, player_id: int) -> Tuple[bool, Optional[str]]:
-        """Проверка победы игрока"""
-        game = self.db.query(Game).filter(Game.id == game_id).first()
-        if not game or game.status != "active":
-            return False, "Game not active"
+    def check_victory(self, game_id: int, player_id: int) -> Tuple[Optional[int], Optional[str]]:
+        """Проверка победы игрока.
+
+        Возвращает номер шара (индекс в called_numbers), на котором
+        карточка заполнилась, то есть выпало последнее из ее чисел.
+        """
+        if self._game_status(game_id) != "active":
+            return None, "Game not active"
             
         card = self.redis.get_player_card(game_id, player_id)
         if not card:
-            return False, "Player card not found"
+            return None, "Player card not found"
             
-        called_numbers = set(self.redis.get_called_numbers(game_id))
+        called_at = {number: ball for ball, number in enumerate(self.redis.get_called_numbers(game_id))}
         
-        # Проверяем все числа в карточке
+        # Все числа карточки должны были выпасть
+        balls = []
         for row in range(3):
             for col in range(9):
-                if card["numbers"][row][col] != 0 and not card["marked"][row][col]:
-                    if card["numbers"][row][col] not in called_numbers:
-                        return False, "Invalid victory claim"
+                number = card["numbers"][row][col]
+                if number != 0:
+                    if number not in called_at:
+                        return None, "Invalid victory claim"
+                    balls.append(called_at[number])
         
+        return max(balls), None
+
+    def claim_victory(self, game_id: int, player_id: int) -> Tuple[bool, Optional[str]]:
+        """Заявка на победу.
+
+        Верная заявка записывается вместе с номером шара, на котором
+        заполнилась карточка; победителя выбирает settle_victory по
+        истечении VICTORY_CLAIM_WINDOW. Уже завершенная игра отсекается
+        до проверки карточки, поэтому всплеск заявок после победы не
+        нагружает ни Redis, ни Postgres.
+        """
+        if self.redis.get_settled_winner(game_id) is not None:
+            return False, "Game already finished"
+
+        ball, error = self.check_victory(game_id, player_id)
+        if ball is None:
+            return False, error
+
+        if not self.redis.record_claim(game_id, player_id, ball):
+            return False, "Game already finished"
         return True, None
 
-    def end_game(self, game_id: int, winner_id: int) -> None:
-        """Завершение игры"""
-        game = self.db.query(Game).filter(Game.id == game_id).first()
-        if not game:
-            return
+    def settle_victory(self, game_id: int) -> Tuple[Optional[int], bool]:
+        """Выбрать победителя среди заявок.
+
+        Побеждает карточка, заполнившаяся на более раннем шаре, а при
+        равенстве - заявка, поступившая первой. Возвращает (победитель,
+        зафиксирован ли итог этим вызовом); завершать игру должен только
+        вызов, зафиксировавший итог.
+        """
+        return self.redis.settle_game(game_id)
+
+    def finish_game(self, game_id: int, winner_id: int) -> Optional[Dict]:
+        """Довести зафиксированный итог до завершения игры.
+
+        Повторный вызов безопасен: статистика начисляется только если игра
+        еще не завершена в Postgres, а отметка о завершении снимается
+        последней, поэтому прерванную попытку повторяет фоновая задача.
+        Возвращает итоги для события GAME_FINISHED или None, если их уже
+        записала предыдущая попытка.
+        """
+        result = self.end_game(game_id, winner_id)
+        self.redis.clear_game_data(game_id)
+        self.redis.complete_settlement(game_id)
+        return result
+
+    def _record_participants(self, game_id: int, players: List[int], winner_id: int) -> None:
+        """Записать участников игры и их итоговый статус в game_players"""
+        existing = {
+            row.user_id for row in self.db.execute(
+                select(game_players.c.user_id).where(game_players.c.game_id == game_id)
+            )
+        }
+        for player_id in existing.intersection(players):
+            self.db.execute(
+                game_players.update()
+                .where(game_players.c.game_id == game_id, game_players.c.user_id == player_id)
+                .values(status="winner" if player_id == winner_id else "finished")
+            )
+        missing = [player_id for player_id in players if player_id not in existing]
+        if missing:
+            self.db.execute(game_players.insert(), [
+                {
+                    "game_id": game_id,
+                    "user_id": player_id,
+                    "status": "winner" if player_id == winner_id else "finished"
+                }
+                for player_id in missing
+            ])
+
+    def end_game(self, game_id: int, winner_id: int) -> Optional[Dict]:
+        """Завершение игры; возвращает итоги для события GAME_FINISHED"""
+        game = self.db.query(Game).filter(Game.id == game_id).with_for_update().first()
+        if not game or game.status == "finished":
+            # Уже завершенной игре статистика повторно не начисляется
+            self.db.rollback()
+            return None
             
         game.status = "finished"
         game.finished_at = datetime.utcnow()
@@ -164,7 +332,6 @@ class GameService:
         winner = self.db.query(User).filter(User.id == winner_id).first()
         if winner:
             winner.games_won += 1
-            winner.rating += 25  # Простая система рейтинга
             
         # Обновляем статистику всех игроков
         players = self.redis.get_game_players(game_id)
@@ -172,19 +339,26 @@ class GameService:
             player = self.db.query(User).filter(User.id == player_id).first()
             if player:
                 player.games_played += 1
-                if player.id != winner_id:
-                    player.rating = max(1000, player.rating - 10)
+        
+        # Фиксируем состав игры: по нему пакетно пересчитывается рейтинг
+        self._record_participants(game_id, players, winner_id)
                     
         # Создаем запись в истории игр
+        duration = (game.finished_at - game.started_at).seconds
         history = GameHistory(
             game_id=game_id,
             winner_id=winner_id,
-            duration=(game.finished_at - game.started_at).seconds,
+            duration=duration,
             players_count=len(players)
         )
         
         self.db.add(history)
         self.db.commit()
+        self.leaderboard.record_win(winner_id, game.finished_at)
         
-        # Очищаем данные игры из Redis
-        self.redis.clear_game_data(game_id) 
\ No newline at end of file
+        # Данные игры в Redis очищает finish_game
+        return {
+            "winner_id": winner_id,
+            "duration": duration,
+            "players": players
+        } 
\ No newline at end of file
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..models.models import GameHistory, User
+from .redis_service import RedisService
+
+GLOBAL_LEADERBOARD_KEY = "leaderboard:global"  # рейтинг игроков
+
+class LeaderboardPeriod(str, Enum):
+    GLOBAL = "global"
+    DAILY = "daily"    # победы за текущие сутки
+    WEEKLY = "weekly"  # победы за текущую неделю (ISO)
+
+# Сколько хранить периодические таблицы после окончания периода
+PERIOD_TTL = {
+    LeaderboardPeriod.DAILY: 2 * 24 * 3600,
+    LeaderboardPeriod.WEEKLY: 8 * 24 * 3600
+}
+
+REBUILD_CHUNK_SIZE = 1000
+
+def period_start(period: LeaderboardPeriod, moment: datetime) -> datetime:
+    """Начало периода, в который попадает момент"""
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == LeaderboardPeriod.WEEKLY:
+        return day - timedelta(days=day.weekday())
+    return day
+
+def leaderboard_key(period: LeaderboardPeriod, moment: Optional[datetime] = None) -> str:
+    """Ключ таблицы лидеров для периода"""
+    if period == LeaderboardPeriod.GLOBAL:
+        return GLOBAL_LEADERBOARD_KEY
+    moment = moment or datetime.utcnow()
+    if period == LeaderboardPeriod.WEEKLY:
+        year, week, _ = moment.isocalendar()
+        return f"leaderboard:weekly:{year}-W{week:02d}"
+    return f"leaderboard:daily:{moment:%Y%m%d}"
+
+class LeaderboardService:
+    def __init__(self, redis: RedisService):
+        self.redis_client = redis.redis_client
+
+    def record_win(self, winner_id: int, finished_at: Optional[datetime] = None) -> None:
+        """Засчитать победу в периодических таблицах"""
+        finished_at = finished_at or datetime.utcnow()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for period, ttl in PERIOD_TTL.items():
+            key = leaderboard_key(period, finished_at)
+            pipe.zincrby(key, 1, winner_id)
+            pipe.expire(key, ttl)
+        pipe.execute()
+
+    @staticmethod
+    def _entries(rows: List[Tuple[bytes, float]], first_rank: int) -> List[Dict]:
+        return [
+            {"rank": first_rank + offset, "user_id": int(member), "score": int(score)}
+            for offset, (member, score) in enumerate(rows)
+        ]
+
+    def get_top(self, period: LeaderboardPeriod, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """Первые игроки таблицы"""
+        rows = self.redis_client.zrevrange(
+            leaderboard_key(period), offset, offset + limit - 1, withscores=True
+        )
+        return self._entries(rows, offset + 1)
+
+    def get_rank(self, period: LeaderboardPeriod, user_id: int) -> Optional[Dict]:
+        """Место и очки игрока"""
+        key = leaderboard_key(period)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrevrank(key, user_id)
+        pipe.zscore(key, user_id)
+        rank, score = pipe.execute()
+        if rank is None:
+            return None
+        return {"rank": rank + 1, "user_id": user_id, "score": int(score)}
+
+    def get_around(self, period: LeaderboardPeriod, user_id: int, radius: int = 5) -> List[Dict]:
+        """Игроки выше и ниже игрока в таблице"""
+        key = leaderboard_key(period)
+        rank = self.redis_client.zrevrank(key, user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - radius)
+        rows = self.redis_client.zrevrange(key, start, rank + radius, withscores=True)
+        return self._entries(rows, start + 1)
+
+    def rebuild(self, db: Session) -> None:
+        """Пересобрать таблицы из Postgres.
+
+        Каждая таблица собирается во временном ключе и подменяет текущую
+        через RENAME, чтобы читатели не видели частично заполненный набор.
+        """
+        now = datetime.utcnow()
+
+        users = (
+            db.query(User.id, User.rating)
+            .filter(User.is_active == True)
+            .yield_per(REBUILD_CHUNK_SIZE)
+        )
+        self._replace(GLOBAL_LEADERBOARD_KEY, ((row.id, row.rating or 0) for row in users))
+
+        for period, ttl in PERIOD_TTL.items():
+            wins = (
+                db.query(GameHistory.winner_id, func.count(GameHistory.id))
+                .filter(
+                    GameHistory.winner_id.isnot(None),
+                    GameHistory.created_at >= period_start(period, now)
+                )
+                .group_by(GameHistory.winner_id)
+                .yield_per(REBUILD_CHUNK_SIZE)
+            )
+            self._replace(leaderboard_key(period, now), wins, ttl)
+
+    def _replace(self, key: str, scores, ttl: Optional[int] = None) -> None:
+        staging_key = f"{key}:rebuild"
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.delete(staging_key)
+        chunk: Dict[int, float] = {}
+        for user_id, score in scores:
+            chunk[user_id] = score
+            if len(chunk) >= REBUILD_CHUNK_SIZE:
+                pipe.zadd(staging_key, chunk)
+                pipe.execute()
+                chunk = {}
+        if chunk:
+            pipe.zadd(staging_key, chunk)
+
+        if ttl:
+            pipe.expire(staging_key, ttl)
+        # RENAME падает на отсутствующем ключе: пустая таблица просто удаляется
+        pipe.exists(staging_key)
+        exists = pipe.execute()[-1]
+        if exists:
+            self.redis_client.rename(staging_key, key)
+        else:
+            self.redis_client.delete(key)
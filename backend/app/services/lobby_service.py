@@ -0,0 +1,68 @@
+import json
+from typing import Dict, List, Optional, Tuple
+from .redis_service import LOBBY_CHANNEL, LOBBY_GAMES_KEY, LOBBY_SUMMARIES_KEY, RedisService
+
+class LobbyService:
+    def __init__(self, redis: RedisService):
+        self.redis_client = redis.redis_client
+
+    @staticmethod
+    def build_summary(game, players_count: int) -> Dict:
+        """Краткое описание игры для лобби"""
+        return {
+            "id": game.id,
+            "creator_id": game.creator_id,
+            "max_players": game.max_players,
+            "players_count": players_count,
+            "created_at": game.created_at.isoformat() if game.created_at else None
+        }
+
+    def upsert(self, summary: Dict) -> None:
+        """Добавить или обновить игру в лобби; заполненная игра из него убирается"""
+        free_seats = summary["max_players"] - summary["players_count"]
+        if free_seats <= 0:
+            self.remove(summary["id"])
+            return
+
+        # Число игроков хранится только в счете множества: его меняет скрипт присоединения
+        static = {key: value for key, value in summary.items() if key != "players_count"}
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zadd(LOBBY_GAMES_KEY, {summary["id"]: free_seats})
+        pipe.hset(LOBBY_SUMMARIES_KEY, summary["id"], json.dumps(static))
+        pipe.publish(LOBBY_CHANNEL, json.dumps({"type": "lobby_update", "game": summary}))
+        pipe.execute()
+
+    def remove(self, game_id: int) -> None:
+        """Убрать игру из лобби"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.zrem(LOBBY_GAMES_KEY, game_id)
+        pipe.hdel(LOBBY_SUMMARIES_KEY, game_id)
+        removed, _ = pipe.execute()
+        if removed:
+            self.redis_client.publish(LOBBY_CHANNEL, json.dumps({"type": "lobby_remove", "game_id": game_id}))
+
+    def list_games(
+        self,
+        offset: int = 0,
+        limit: int = 20,
+        min_free_seats: int = 1,
+        max_free_seats: Optional[int] = None
+    ) -> Tuple[List[Dict], int]:
+        """Страница игр лобби, начиная с почти заполненных, и их общее число"""
+        low = max(min_free_seats, 1)
+        high = max_free_seats if max_free_seats is not None else "+inf"
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zrangebyscore(LOBBY_GAMES_KEY, low, high, start=offset, num=limit, withscores=True)
+        pipe.zcount(LOBBY_GAMES_KEY, low, high)
+        entries, total = pipe.execute()
+        if not entries:
+            return [], total
+
+        summaries = self.redis_client.hmget(LOBBY_SUMMARIES_KEY, [game_id for game_id, _ in entries])
+        games = []
+        for (_, free_seats), raw in zip(entries, summaries):
+            if raw:
+                summary = json.loads(raw)
+                summary["players_count"] = summary["max_players"] - int(free_seats)
+                games.append(summary)
+        return games, total
\ No newline at end of file
@@ -1,14 +1,58 @@
 import redis
 import json
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import os
+import time
 from dotenv import load_dotenv
+from .card_codec import decode_card, encode_card
 
 load_dotenv()
 
+# Sorted set of game ids scored by the timestamp of their last activity
+GAMES_ACTIVITY_KEY = "games:activity"
+
+LOBBY_GAMES_KEY = "lobby:games"          # игры, к которым можно присоединиться; счет - свободные места
+LOBBY_SUMMARIES_KEY = "lobby:summaries"  # game_id -> краткое описание игры в JSON
+LOBBY_CHANNEL = "lobby:updates"
+
+CARD_TTL = 3600  # карточки игры хранятся одним хешем game:{id}:cards
+
+# Коды результата JOIN_GAME_SCRIPT; положительный результат - число игроков
+JOIN_NO_META = -1
+JOIN_NOT_WAITING = -2
+JOIN_ALREADY_JOINED = -3
+JOIN_FULL = -4
+
+SETTLED_TTL = 3600  # итог игры хранится дольше остальных ключей
+
+# Игры с заявками на победу, которые еще не доведены до завершения;
+# счет - время первой заявки. Незавершенные игры дозавершает фоновая задача
+GAMES_SETTLING_KEY = "games:settling"
+
+def game_key_footprint(game_id) -> List[str]:
+    """Все ключи игры в Redis, кроме чата (его удаляет архиватор).
+
+    Итог игры (game:{id}:settled) сюда не входит: он живет до истечения TTL,
+    чтобы запоздавшие заявки на победу отсекались без обращения к Postgres.
+    """
+    return [
+        f"game:{game_id}",
+        f"game:{game_id}:meta",
+        f"game:{game_id}:players",
+        f"game:{game_id}:called_numbers",
+        f"game:{game_id}:standings",
+        f"game:{game_id}:events",
+        f"game:{game_id}:last_activity",
+        f"game:{game_id}:cards",
+        f"game:{game_id}:claims"
+    ]
+
 class RedisService:
     def __init__(self):
         self.redis_client = redis.from_url(os.getenv("REDIS_URL"))
+        self._join_script = None
+        self._claim_script = None
+        self._settle_script = None
 
     def set_game_state(self, game_id: int, state: Dict) -> None:
         """Сохранить состояние игры в Redis"""
@@ -23,6 +67,104 @@ class RedisService:
         state = self.redis_client.get(f"game:{game_id}")
         return json.loads(state) if state else None
 
+    def set_game_meta(self, game_id: int, status: str, max_players: int, only_missing: bool = False) -> None:
+        """Сохранить статус и число мест игры, по которым проверяется присоединение"""
+        key = f"game:{game_id}:meta"
+        if only_missing:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.hsetnx(key, "status", status)
+            pipe.hsetnx(key, "max_players", max_players)
+            pipe.execute()
+        else:
+            self.redis_client.hset(key, mapping={"status": status, "max_players": max_players})
+
+    def get_game_status(self, game_id: int) -> Optional[str]:
+        """Статус игры из метаданных"""
+        status = self.redis_client.hget(f"game:{game_id}:meta", "status")
+        return status.decode() if status else None
+
+    def start_game_players(self, game_id: int) -> List[int]:
+        """Закрыть игру для присоединения и вернуть окончательный состав"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(f"game:{game_id}:meta", "status", "active")
+        pipe.smembers(f"game:{game_id}:players")
+        _, players = pipe.execute()
+        return [int(player) for player in players]
+
+    def join_game(self, game_id: int, player_id: int, card: Dict) -> int:
+        """Атомарно занять место в игре и выдать карточку.
+
+        Возвращает число игроков после присоединения или код JOIN_*.
+        """
+        if self._join_script is None:
+            self._join_script = self.redis_client.register_script(JOIN_GAME_SCRIPT)
+        return self._join_script(
+            keys=[
+                f"game:{game_id}:meta",
+                f"game:{game_id}:players",
+                f"game:{game_id}:cards",
+                GAMES_ACTIVITY_KEY,
+                LOBBY_GAMES_KEY,
+                LOBBY_SUMMARIES_KEY
+            ],
+            args=[player_id, encode_card(card), CARD_TTL, game_id, time.time(), LOBBY_CHANNEL]
+        )
+
+    def get_settled_winner(self, game_id: int) -> Optional[int]:
+        """Победитель уже завершенной игры"""
+        winner = self.redis_client.get(f"game:{game_id}:settled")
+        return int(winner) if winner else None
+
+    def record_claim(self, game_id: int, player_id: int, ball: int) -> bool:
+        """Записать верную заявку на победу; False, если итог уже зафиксирован"""
+        if self._claim_script is None:
+            self._claim_script = self.redis_client.register_script(RECORD_CLAIM_SCRIPT)
+        return bool(self._claim_script(
+            keys=[f"game:{game_id}:settled", f"game:{game_id}:claims", GAMES_SETTLING_KEY],
+            args=[player_id, ball, SETTLED_TTL, game_id, time.time()]
+        ))
+
+    def settle_game(self, game_id: int) -> Tuple[Optional[int], bool]:
+        """Зафиксировать победителя по лучшей заявке.
+
+        Возвращает (победитель, зафиксирован ли итог этим вызовом).
+        """
+        if self._settle_script is None:
+            self._settle_script = self.redis_client.register_script(SETTLE_GAME_SCRIPT)
+        result = self._settle_script(
+            keys=[f"game:{game_id}:settled", f"game:{game_id}:meta", f"game:{game_id}:claims"],
+            args=[SETTLED_TTL]
+        )
+        if not result:
+            return None, False
+        winner, settled_now = result
+        return int(winner), bool(settled_now)
+
+    def get_stalled_settlements(self, cutoff: float) -> List[int]:
+        """Игры, первая заявка на победу в которых поступила раньше cutoff"""
+        return [int(game_id) for game_id in self.redis_client.zrangebyscore(GAMES_SETTLING_KEY, "-inf", cutoff)]
+
+    def complete_settlement(self, game_id: int) -> None:
+        """Отметить, что игра с заявками на победу доведена до завершения"""
+        self.redis_client.zrem(GAMES_SETTLING_KEY, game_id)
+
+    def touch_game(self, game_id: int) -> None:
+        """Отметить активность в игре"""
+        self.redis_client.zadd(GAMES_ACTIVITY_KEY, {game_id: time.time()})
+
+    def init_matched_game(self, game_id: int, state: Dict, cards: Dict[int, Dict], max_players: int) -> None:
+        """Атомарно сохранить состояние, состав и карточки новой игры"""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.setex(f"game:{game_id}", 3600, json.dumps(state))
+        pipe.hset(f"game:{game_id}:meta", mapping={"status": state["status"], "max_players": max_players})
+        pipe.sadd(f"game:{game_id}:players", *cards)
+        pipe.hset(f"game:{game_id}:cards", mapping={
+            player_id: encode_card(card) for player_id, card in cards.items()
+        })
+        pipe.expire(f"game:{game_id}:cards", CARD_TTL)
+        pipe.zadd(GAMES_ACTIVITY_KEY, {game_id: time.time()})
+        pipe.execute()
+
     def add_player_to_game(self, game_id: int, player_id: int) -> None:
         """Добавить игрока в игру"""
         self.redis_client.sadd(f"game:{game_id}:players", player_id)
@@ -38,16 +180,20 @@ class RedisService:
 
     def set_player_card(self, game_id: int, player_id: int, card: Dict) -> None:
         """Сохранить карточку игрока"""
-        self.redis_client.setex(
-            f"game:{game_id}:player:{player_id}:card",
-            3600,
-            json.dumps(card)
-        )
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(f"game:{game_id}:cards", player_id, encode_card(card))
+        pipe.expire(f"game:{game_id}:cards", CARD_TTL)
+        pipe.execute()
 
     def get_player_card(self, game_id: int, player_id: int) -> Optional[Dict]:
         """Получить карточку игрока"""
-        card = self.redis_client.get(f"game:{game_id}:player:{player_id}:card")
-        return json.loads(card) if card else None
+        card = self.redis_client.hget(f"game:{game_id}:cards", player_id)
+        return decode_card(card) if card else None
+
+    def get_game_cards(self, game_id: int) -> Dict[int, Dict]:
+        """Получить карточки всех игроков одним запросом"""
+        cards = self.redis_client.hgetall(f"game:{game_id}:cards")
+        return {int(player_id): decode_card(card) for player_id, card in cards.items()}
 
     def add_called_number(self, game_id: int, number: int) -> None:
         """Добавить выпавшее число в список"""
@@ -60,6 +206,97 @@ class RedisService:
 
     def clear_game_data(self, game_id: int) -> None:
         """Очистить все данные игры"""
-        keys = self.redis_client.keys(f"game:{game_id}*")
-        if keys:
-            self.redis_client.delete(*keys) 
\ No newline at end of file
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.delete(*game_key_footprint(game_id))
+        pipe.zrem(GAMES_ACTIVITY_KEY, game_id)
+        pipe.zrem(LOBBY_GAMES_KEY, game_id)
+        pipe.hdel(LOBBY_SUMMARIES_KEY, game_id)
+        pipe.sismember("chat:games", game_id)
+        results = pipe.execute()
+        in_lobby, has_chat = results[-3], results[-1]
+        if in_lobby:
+            self.redis_client.publish(LOBBY_CHANNEL, json.dumps({"type": "lobby_remove", "game_id": game_id}))
+        # Чат удаляет архиватор после переноса истории в Postgres
+        if has_chat:
+            self.redis_client.sadd("chat:closed_games", game_id)
+
+# KEYS: метаданные игры, игроки, карточки игры, активность игр, лобби, описания лобби
+# ARGV: игрок, карточка (card_codec), TTL карточек, игра, текущее время, канал лобби
+# Обновление лобби публикуется здесь же: описание игры - JSON-объект, к которому
+# число игроков дописывается перед закрывающей скобкой
+JOIN_GAME_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[1], 'status', 'max_players')
+if not meta[1] then
+    return -1
+end
+if meta[1] ~= 'waiting' then
+    return -2
+end
+if redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1 then
+    return -3
+end
+local max_players = tonumber(meta[2])
+local count = redis.call('SCARD', KEYS[2])
+if count >= max_players then
+    return -4
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+redis.call('ZADD', KEYS[4], ARGV[5], ARGV[4])
+count = count + 1
+local summary = redis.call('HGET', KEYS[6], ARGV[4])
+if count >= max_players or not summary then
+    redis.call('HDEL', KEYS[6], ARGV[4])
+    -- Клиенты узнают об удалении, только если игра была в лобби
+    if redis.call('ZREM', KEYS[5], ARGV[4]) == 1 then
+        redis.call('PUBLISH', ARGV[6], '{"type": "lobby_remove", "game_id": ' .. ARGV[4] .. '}')
+    end
+else
+    redis.call('ZADD', KEYS[5], max_players - count, ARGV[4])
+    redis.call('PUBLISH', ARGV[6], '{"type": "lobby_update", "game": '
+        .. string.sub(summary, 1, -2) .. ', "players_count": ' .. count .. '}}')
+end
+return count
+"""
+
+# KEYS: итог игры, заявки на победу, игры в процессе завершения
+# ARGV: игрок, номер шара, на котором заполнилась карточка, TTL заявок, id игры, текущее время
+# Счет заявки: номер шара * 2^20 + порядок поступления; порядок ограничен
+# 2^20, поэтому более ранний шар всегда выигрывает, а счет остается точным
+RECORD_CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local order = redis.call('ZCARD', KEYS[2])
+if order >= 1048576 then
+    return redis.error_reply('too many victory claims')
+end
+redis.call('ZADD', KEYS[2], 'NX', tonumber(ARGV[2]) * 1048576 + order, ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[3], 'NX', ARGV[5], ARGV[4])
+return 1
+"""
+
+# KEYS: итог игры, метаданные игры, заявки на победу
+# ARGV: TTL итога
+# Возвращает {победитель, 1 если итог зафиксирован этим вызовом}
+SETTLE_GAME_SCRIPT = """
+local settled = redis.call('GET', KEYS[1])
+if settled then
+    return {settled, 0}
+end
+local status = redis.call('HGET', KEYS[2], 'status')
+if status and status ~= 'active' then
+    return false
+end
+local best = redis.call('ZRANGE', KEYS[3], 0, 0)
+if not best[1] then
+    return false
+end
+redis.call('SET', KEYS[1], best[1], 'EX', ARGV[1])
+if status then
+    redis.call('HSET', KEYS[2], 'status', 'finished')
+end
+return {best[1], 1}
+"""
\ No newline at end of file
@@ -1,8 +1,12 @@
 from fastapi import WebSocket, WebSocketDisconnect
 from typing import Dict, Set, Optional
+import asyncio
 import json
-from ..services.game_service import GameService
+from ..services.game_service import VICTORY_CLAIM_WINDOW, GameService
 from ..services.redis_service import RedisService
+from ..core.events import event_manager, GameEvent, GameEventType
+from ..core.standings import standings_manager
+from ..core.presence import presence_manager
 
 class ConnectionManager:
     def __init__(self):
@@ -18,10 +22,13 @@ class ConnectionManager:
         if player_id not in self.player_games:
             self.player_games[player_id] = set()
         self.player_games[player_id].add(game_id)
+        await presence_manager.register(player_id, websocket)
 
-    def disconnect(self, game_id: int, player_id: int):
+    async def disconnect(self, game_id: int, player_id: int):
         if game_id in self.active_connections:
-            self.active_connections[game_id].pop(player_id, None)
+            websocket = self.active_connections[game_id].pop(player_id, None)
+            if websocket:
+                await presence_manager.unregister(player_id, websocket)
             if not self.active_connections[game_id]:
                 del self.active_connections[game_id]
         
@@ -44,6 +51,7 @@ class GameWebSocket:
         self.manager = ConnectionManager()
         self.game_service = game_service
         self.redis_service = redis_service
+        self._settlements: Set[asyncio.Task] = set()
 
     async def handle_connection(self, websocket: WebSocket, game_id: int, player_id: int):
         await self.manager.connect(websocket, game_id, player_id)
@@ -54,7 +62,7 @@ class GameWebSocket:
                 await self.handle_message(game_id, player_id, data)
                 
         except WebSocketDisconnect:
-            self.manager.disconnect(game_id, player_id)
+            await self.manager.disconnect(game_id, player_id)
             await self.manager.broadcast_to_game(
                 game_id,
                 {
@@ -63,6 +71,30 @@ class GameWebSocket:
                 }
             )
 
+    async def settle_game(self, game_id: int):
+        """Выбрать победителя по истечении окна заявок и завершить игру"""
+        # Встречные заявки успевают поступить до выбора победителя
+        await asyncio.sleep(VICTORY_CLAIM_WINDOW)
+        winner_id, settled_now = self.game_service.settle_victory(game_id)
+        if not settled_now:
+            return
+        # Если завершение прервется, его повторит задача finish_settled_games
+        result = self.game_service.finish_game(game_id, winner_id)
+        if result:
+            await event_manager.publish_event(GameEvent(
+                event_type=GameEventType.GAME_FINISHED,
+                game_id=str(game_id),
+                player_id=str(winner_id),
+                data=result
+            ))
+        await self.manager.broadcast_to_game(
+            game_id,
+            {
+                "type": "game_over",
+                "winner_id": winner_id
+            }
+        )
+
     async def handle_message(self, game_id: int, player_id: int, data: dict):
         message_type = data.get("type")
         
@@ -71,12 +103,16 @@ class GameWebSocket:
             card = self.redis_service.get_player_card(game_id, player_id)
             if card:
                 # Обновляем отмеченные числа в карточке
+                newly_marked = False
                 for row in range(3):
                     for col in range(9):
-                        if card["numbers"][row][col] == number:
+                        if card["numbers"][row][col] == number and not card["marked"][row][col]:
                             card["marked"][row][col] = True
+                            newly_marked = True
                 self.redis_service.set_player_card(game_id, player_id, card)
+                self.redis_service.touch_game(game_id)
                 
+                # Игрок получает карточку до учета отметки в таблице и событиях
                 await self.manager.send_personal_message(
                     game_id,
                     player_id,
@@ -86,17 +122,27 @@ class GameWebSocket:
                     }
                 )
                 
+                if newly_marked:
+                    marked_count, leader_count = await standings_manager.record_mark(game_id, player_id)
+                    await event_manager.publish_event(GameEvent(
+                        event_type=GameEventType.NUMBER_MARKED,
+                        game_id=str(game_id),
+                        player_id=str(player_id),
+                        data={
+                            "number": number,
+                            "marked_count": marked_count,
+                            "leader_count": leader_count
+                        }
+                    ))
+                
         elif message_type == "claim_victory":
-            success, error = self.game_service.check_victory(game_id, player_id)
+            success, error = self.game_service.claim_victory(game_id, player_id)
             if success:
-                self.game_service.end_game(game_id, player_id)
-                await self.manager.broadcast_to_game(
-                    game_id,
-                    {
-                        "type": "game_over",
-                        "winner_id": player_id
-                    }
-                )
+                # Победитель выбирается отдельной задачей, чтобы окно заявок
+                # не задерживало остальные сообщения игрока
+                task = asyncio.create_task(self.settle_game(game_id))
+                self._settlements.add(task)
+                task.add_done_callback(self._settlements.discard)
             else:
                 await self.manager.send_personal_message(
                     game_id,
@@ -0,0 +1,91 @@
+"""Benchmark chat moderation throughput.
+
+Usage: python scripts/bench_moderation.py [--words 5000] [--messages 100000]
+
+Target: at least 10 000 messages per second on one core. Before the
+benchmark, a few known false positives are checked and the script
+exits with an error if any of them is masked.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.core.moderation import ModerationEngine  # noqa: E402
+
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+CYRILLIC = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+CHAT_WORDS = (
+    "привет", "всем", "удачи", "бинго", "карточка", "число", "ещё", "одно",
+    "hello", "good", "luck", "nice", "game", "almost", "there", "gg", "wp",
+    "кто", "выиграл", "давай", "быстрее", "ура", "спасибо", "number", "card"
+)
+
+# Whole-word entries must not mask longer words that merely start with them
+FALSE_POSITIVE_WORDS = ("hell", "tit", "ass", "here", "bad*")
+FALSE_POSITIVE_CASES = (
+    ("hello title assessment heresy", "hello title assessment heresy"),
+    ("go to hell", "go to ****"),
+    ("Here we go", "**** we go"),
+    ("badly played", "***** played"),
+    ("b@d", "***"),
+)
+
+def check_false_positives() -> bool:
+    engine = ModerationEngine(FALSE_POSITIVE_WORDS)
+    ok = True
+    for message, expected in FALSE_POSITIVE_CASES:
+        result = engine.moderate(message)
+        if result != expected:
+            print(f"moderation mismatch: {message!r} -> {result!r}, expected {expected!r}")
+            ok = False
+    return ok
+
+def random_word(rng: random.Random, alphabet: str) -> str:
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(4, 9)))
+
+def build_messages(rng: random.Random, count: int, bad_words) -> list:
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(CHAT_WORDS) for _ in range(rng.randint(3, 12))]
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(bad_words) + "ами")
+        messages.append(" ".join(words))
+    return messages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not check_false_positives():
+        sys.exit(1)
+
+    rng = random.Random(args.seed)
+    bad_words = [
+        random_word(rng, CYRILLIC if i % 2 else LATIN)
+        for i in range(args.words)
+    ]
+    messages = build_messages(rng, args.messages, bad_words)
+
+    started = time.perf_counter()
+    # Generated messages use inflected forms, so the list is made of stems
+    engine = ModerationEngine(word + "*" for word in bad_words)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    moderated = sum(1 for message in messages if engine.moderate(message) != message)
+    elapsed = time.perf_counter() - started
+
+    rate = len(messages) / elapsed
+    print(f"words: {args.words}, automaton built in {build_time * 1000:.1f} ms")
+    print(f"messages: {len(messages)}, moderated: {moderated}")
+    print(f"throughput: {rate:,.0f} messages/sec ({'OK' if rate >= 10000 else 'BELOW TARGET'})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# App modules read these at import time: tests use SQLite and an in-memory Redis
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "bingo_tests.db"))
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,158 @@
+"""Email queue against a local aiosmtpd relay and an in-memory Redis"""
+import asyncio
+import json
+import socket
+from datetime import datetime
+import fakeredis.aioredis
+import pytest
+from aiosmtpd.controller import Controller
+from app.core.cache import CacheManager
+from app.core.database import SessionLocal, engine
+from app.core.mailer import (
+    EMAIL_DEAD_KEY,
+    EMAIL_QUEUE_KEY,
+    EMAIL_RETRY_KEY,
+    EMAIL_WORKER_TIMEOUT,
+    EMAIL_WORKERS_KEY,
+    EmailQueue,
+    _processing_key
+)
+from app.models.models import Base, User
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.peers.add(session.peer)
+        return "250 Message accepted for delivery"
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+@pytest.fixture
+def user_id():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = User(username="alice", email="alice@example.com")
+        db.add(user)
+        db.commit()
+        yield str(user.id)
+    finally:
+        db.close()
+
+@pytest.fixture(autouse=True)
+def redis():
+    CacheManager._redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    yield CacheManager._redis
+    CacheManager._redis = None
+
+def _queue(port: int, **kwargs) -> EmailQueue:
+    queue = EmailQueue(retry_base_delay=0, **kwargs)
+    queue.config.update(hostname="127.0.0.1", port=port, use_tls=False, start_tls=False)
+    return queue
+
+async def _wait_until(predicate, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+async def _claimed(redis, queue: EmailQueue) -> bool:
+    return await redis.llen(_processing_key(queue.worker_id)) > 0
+
+def test_sends_batch_over_pooled_connections(smtp, user_id, redis):
+    queue = _queue(smtp.port)
+
+    async def scenario():
+        for i in range(5):
+            await queue.enqueue(user_id, f"Subject {i}", "Body")
+        assert await queue.process_batch() == 5
+        await queue.pool.close()
+        assert await redis.llen(EMAIL_QUEUE_KEY) == 0
+        assert await redis.llen(_processing_key(queue.worker_id)) == 0
+
+    asyncio.run(scenario())
+    assert len(smtp.handler.messages) == 5
+    assert all(envelope.rcpt_tos == ["alice@example.com"] for envelope in smtp.handler.messages)
+    assert len(smtp.handler.peers) <= queue.pool.size
+
+def test_failed_send_is_retried_then_dead_lettered(user_id, redis):
+    # Nothing listens on this port, so every send fails
+    queue = _queue(_free_port(), max_attempts=2)
+
+    async def scenario():
+        await queue.enqueue(user_id, "Subject", "Body")
+        assert await queue.process_batch() == 0
+        assert await redis.zcard(EMAIL_RETRY_KEY) == 1
+        assert await redis.llen(_processing_key(queue.worker_id)) == 0
+
+        # The retry is due immediately and is promoted by the next batch
+        assert await queue.process_batch() == 0
+        assert await redis.zcard(EMAIL_RETRY_KEY) == 0
+        dead = [json.loads(raw) for raw in await redis.lrange(EMAIL_DEAD_KEY, 0, -1)]
+        assert [job["attempts"] for job in dead] == [2]
+
+    asyncio.run(scenario())
+
+def test_jobs_of_crashed_worker_are_requeued(smtp, user_id, redis):
+    crashed = _queue(smtp.port)
+    healthy = _queue(smtp.port)
+
+    async def hang(message):
+        await asyncio.Event().wait()
+
+    crashed.pool.send = hang
+
+    async def scenario():
+        await crashed.enqueue(user_id, "Subject", "Body")
+        task = asyncio.create_task(crashed.process_batch())
+        await _wait_until(lambda: _claimed(redis, crashed))
+        task.cancel()
+
+        # A live worker leaves the claimed job alone
+        assert await healthy.process_batch() == 0
+        assert await redis.llen(_processing_key(crashed.worker_id)) == 1
+
+        # Once the crashed worker's heartbeat is stale, its job is sent
+        stale = datetime.now().timestamp() - EMAIL_WORKER_TIMEOUT - 1
+        await redis.zadd(EMAIL_WORKERS_KEY, {crashed.worker_id: stale})
+        assert await healthy.process_batch() == 1
+        await healthy.pool.close()
+        assert await redis.llen(_processing_key(crashed.worker_id)) == 0
+        assert await redis.zscore(EMAIL_WORKERS_KEY, crashed.worker_id) is None
+
+    asyncio.run(scenario())
+    assert len(smtp.handler.messages) == 1
+
+def test_stop_returns_claimed_jobs_to_queue(smtp, user_id, redis):
+    queue = _queue(smtp.port)
+
+    async def hang(message):
+        await asyncio.Event().wait()
+
+    queue.pool.send = hang
+
+    async def scenario():
+        await queue.enqueue(user_id, "Subject", "Body")
+        await queue.start()
+        await _wait_until(lambda: _claimed(redis, queue))
+        await queue.stop()
+        assert await redis.llen(_processing_key(queue.worker_id)) == 0
+        assert await redis.llen(EMAIL_QUEUE_KEY) == 1
+
+    asyncio.run(scenario())